@@ -0,0 +1,136 @@
+# analysis_cache.py
+
+import os
+import gzip
+import json
+import hashlib
+import logging
+from pathlib import Path
+from disk_cache import DiskCache
+
+# Emplacement et taille maximale par défaut du cache d'analyse
+DEFAULT_CACHE_DIR = os.path.join(Path.home(), '.audiobook_cache', 'analysis')
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2  # 512 Mo
+ENTRY_SUFFIX = '.jsonl.gz'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_digest(path):
+    """
+    Retourne le SHA-256 du contenu du fichier.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AnalysisEntryWriter:
+    """
+    Écrit une entrée du cache au fil de l'analyse : les lignes d'un PDF
+    (write_line) puis les chapitres (write_chapter). L'entrée n'est publiée
+    qu'à la sortie du bloc with sans exception ; une erreur d'écriture
+    désactive l'entrée sans interrompre l'analyse.
+    """
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.path = cache._path(key)
+        self.tmp_path = cache._tmp_path(key)
+        self.file = None
+
+    def __enter__(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = gzip.open(self.tmp_path, 'wt', encoding='utf-8', compresslevel=6)
+        except OSError as e:
+            self._fail(e)
+        return self
+
+    def _write(self, record):
+        if self.file is None:
+            return
+        try:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            self._fail(e)
+
+    def write_line(self, text, font_size):
+        # Les lignes sont des listes, les chapitres des objets : la lecture des
+        # chapitres peut ainsi ignorer les lignes sans les décoder
+        self._write([text, font_size])
+
+    def write_chapter(self, title, content, content_src=None):
+        self._write({'title': title, 'content': content, 'content_src': content_src})
+
+    def _fail(self, error):
+        logging.warning(f"Impossible d'ajouter l'entrée {self.key} au cache d'analyse : {error}")
+        self._discard()
+
+    def _discard(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.file is None:
+            return False
+        if exc_type is not None:
+            self._discard()
+            return False
+        try:
+            self.file.close()
+            self.file = None
+            os.replace(self.tmp_path, self.path)
+            size = os.path.getsize(self.path)
+        except OSError as e:
+            self._fail(e)
+            return False
+        self.cache._register(self.key, size)
+        return False
+
+class AnalysisCache(DiskCache):
+    """
+    Cache disque des résultats d'analyse des ePub et PDF : chapitres et, pour les PDF,
+    texte et taille de police de chaque ligne. La clé combine le hash du contenu du
+    fichier et la version du code d'extraction ; les entrées les moins récemment
+    utilisées sont supprimées lorsque la taille totale dépasse max_bytes.
+    """
+    suffix = ENTRY_SUFFIX
+    description = "cache d'analyse"
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    @staticmethod
+    def make_key(digest, processor_version):
+        payload = json.dumps([digest, processor_version])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get_chapters(self, key):
+        """
+        Retourne les chapitres de l'entrée ({'title', 'content', 'content_src'}), ou None si elle est absente.
+        """
+        f = self._lookup(key, lambda path: gzip.open(path, 'rt', encoding='utf-8'))
+        if f is None:
+            return None
+        try:
+            with f:
+                return [json.loads(record) for record in f if record.startswith('{')]
+        except (OSError, EOFError, ValueError) as e:
+            logging.warning(f"Entrée {key} du cache d'analyse illisible : {e}")
+            self.discard(key)
+            return None
+
+    def writer(self, key):
+        return AnalysisEntryWriter(self, key)
+
+def get_default_analysis_cache():
+    """
+    Retourne le cache d'analyse partagé du processus, créé à la première utilisation.
+    """
+    return AnalysisCache.shared()
@@ -0,0 +1,62 @@
+# audio_cache.py
+
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from disk_cache import DiskCache
+
+# Emplacement et taille maximale par défaut du cache audio
+DEFAULT_CACHE_DIR = os.path.join(Path.home(), '.audiobook_cache', 'tts')
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 Go
+
+class AudioCache(DiskCache):
+    """
+    Cache disque des segments audio synthétisés, adressé par le contenu.
+    La clé est un hash de (moteur, texte, voix, débit, volume) ; les entrées les moins
+    récemment utilisées sont supprimées lorsque la taille totale dépasse max_bytes.
+    """
+    suffix = '.mp3'
+    description = 'cache audio'
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    @staticmethod
+    def make_key(text, voice, rate, volume, engine='edge'):
+        payload = json.dumps([engine, text, voice, rate, volume], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key, dest_file):
+        """
+        Copie l'entrée du cache vers dest_file. Retourne True en cas de succès.
+        """
+        return self._lookup(key, lambda path: shutil.copyfile(path, dest_file)) is not None
+
+    def get_bytes(self, key):
+        """
+        Retourne le contenu audio de l'entrée, ou None si elle est absente.
+        """
+        def read(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        return self._lookup(key, read)
+
+    def put(self, key, src_file):
+        """
+        Ajoute src_file au cache sous la clé donnée, puis applique la limite de taille.
+        """
+        self._store(key, lambda tmp_path: shutil.copyfile(src_file, tmp_path))
+
+    def put_bytes(self, key, data):
+        def write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        self._store(key, write)
+
+def get_default_cache():
+    """
+    Retourne le cache audio partagé du processus, créé à la première utilisation.
+    """
+    return AudioCache.shared()
@@ -0,0 +1,184 @@
+# bench_analysis.py
+#
+# Mesure de l'analyse des documents (ePub et PDF) sur des livres synthétiques.
+# Chaque étape est chronométrée séparément, puis rejouée une fois sous
+# tracemalloc pour relever le pic de mémoire. Les résultats sont écrits en
+# JSON avec le commit courant, afin de comparer deux versions :
+#
+#   python benchmarks/bench_analysis.py -o avant.json
+#   python benchmarks/bench_analysis.py -o apres.json --compare avant.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import epub_processor
+from epub_processor import EpubProcessor, PdfProcessor
+from synthetic_corpus import make_epub, make_pdf
+
+def git_commit():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+def measure(func, repeat):
+    """
+    Exécute func repeat fois puis une fois sous tracemalloc.
+    Retourne (résultat, statistiques).
+    """
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, {
+        'seconds_min': round(min(durations), 6),
+        'seconds_median': round(statistics.median(durations), 6),
+        'peak_bytes': peak,
+    }
+
+def bench_clean(texts, repeat):
+    return measure(lambda: [epub_processor.clean_and_format_text(text) for text in texts], repeat)[1]
+
+def bench_epub(path, repeat, max_workers=1):
+    stages = {}
+    chapters, stages['extract_metadata'] = measure(lambda: EpubProcessor().extract_metadata(path), repeat)
+    chapters, stages['analyze_epub'] = measure(lambda: EpubProcessor(max_workers).analyze_epub(path), repeat)
+    stages['clean_and_format_text'] = bench_clean([chapter.content for chapter in chapters], repeat)
+    return {
+        'input_bytes': os.path.getsize(path),
+        'chapters': len(chapters),
+        'characters': sum(len(chapter.content) for chapter in chapters),
+        'stages': stages,
+    }
+
+def bench_pdf(path, repeat, max_workers=1):
+    stages = {}
+    processor = PdfProcessor(max_workers)
+    text_content, stages['extract_text_and_fonts_from_pdf'] = measure(
+        lambda: processor.extract_text_and_fonts_from_pdf(path), repeat)
+
+    # detect_chapters appelle clean_and_format_text : on capture ses entrées
+    # pour mesurer le nettoyage à part, puis on le retire du temps de détection
+    clean_inputs = []
+    original_clean = epub_processor.clean_and_format_text
+    def capturing_clean(text):
+        clean_inputs.append(text)
+        return original_clean(text)
+    epub_processor.clean_and_format_text = capturing_clean
+    try:
+        chapters = processor.detect_chapters(text_content)
+    finally:
+        epub_processor.clean_and_format_text = original_clean
+
+    chapters, detection = measure(lambda: processor.detect_chapters(text_content), repeat)
+    clean = bench_clean(clean_inputs, repeat)
+    for key in ('seconds_min', 'seconds_median'):
+        detection[key] = round(max(detection[key] - clean[key], 0.0), 6)
+    stages['detect_chapters'] = detection
+    stages['clean_and_format_text'] = clean
+
+    # Détection en flux (au-delà de STREAMING_MIN_PAGES pages) : durée totale, pic de mémoire
+    # et délai avant le premier chapitre
+    _, stages['iter_pdf_chapters'] = measure(lambda: list(processor.iter_pdf_chapters(path)), repeat)
+    started = time.perf_counter()
+    next(processor.iter_pdf_chapters(path), None)
+    first_chapter_seconds = round(time.perf_counter() - started, 6)
+    return {
+        'input_bytes': os.path.getsize(path),
+        'lines': len(text_content),
+        'chapters': len(chapters),
+        'characters': sum(len(chapter['content']) for chapter in chapters),
+        'first_chapter_seconds': first_chapter_seconds,
+        'stages': stages,
+    }
+
+def run_benchmarks(args):
+    cases = {}
+    with tempfile.TemporaryDirectory(prefix='bench_analysis_') as corpus_dir:
+        for chapters in args.epub_chapters:
+            path = os.path.join(corpus_dir, f'livre_{chapters}x{args.epub_chapter_kb}k.epub')
+            make_epub(path, chapters=chapters, chapter_kb=args.epub_chapter_kb, seed=args.seed)
+            cases[f'epub_{chapters}x{args.epub_chapter_kb}k'] = bench_epub(path, args.repeat, args.workers or None)
+        for pages in args.pdf_pages:
+            path = os.path.join(corpus_dir, f'livre_{pages}p.pdf')
+            make_pdf(path, pages=pages, seed=args.seed)
+            cases[f'pdf_{pages}p'] = bench_pdf(path, args.repeat, args.workers or None)
+    return {
+        'benchmark': 'analysis',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': round(time.time(), 3),
+        'repeat': args.repeat,
+        'workers': args.workers,
+        'cases': cases,
+    }
+
+def compare(baseline, current):
+    """
+    Affiche, pour chaque étape commune, le temps médian et le pic mémoire
+    avant/après ainsi que le rapport entre les deux.
+    """
+    print(f"Référence : {baseline.get('commit')}  Actuel : {current.get('commit')}")
+    print(f"{'cas / étape':<58} {'avant (s)':>10} {'après (s)':>10} {'rapport':>8} {'mém. avant':>11} {'mém. après':>11}")
+    for case, result in current['cases'].items():
+        base_case = baseline.get('cases', {}).get(case)
+        if not base_case:
+            continue
+        for stage, stats in result['stages'].items():
+            base = base_case['stages'].get(stage)
+            if not base:
+                continue
+            ratio = stats['seconds_median'] / base['seconds_median'] if base['seconds_median'] else float('inf')
+            print(f"{case + ' / ' + stage:<58} {base['seconds_median']:>10.4f} {stats['seconds_median']:>10.4f} "
+                  f"{ratio:>7.2f}x {base['peak_bytes'] // 1024:>9}Ko {stats['peak_bytes'] // 1024:>9}Ko")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesure l'analyse des ePub et PDF sur des livres synthétiques.")
+    parser.add_argument('--epub-chapters', type=int, nargs='+', default=[20, 200],
+                        help="Nombre de chapitres des ePub générés (un cas par valeur)")
+    parser.add_argument('--epub-chapter-kb', type=int, default=50, help="Taille de chaque chapitre XHTML, en Ko")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Processus d'analyse des documents XHTML et des pages PDF (0 : un par cœur)")
+    parser.add_argument('--pdf-pages', type=int, nargs='+', default=[50], help="Nombre de pages des PDF générés")
+    parser.add_argument('--repeat', type=int, default=3, help="Nombre de mesures par étape")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help="Fichier JSON de résultats (sortie standard par défaut)")
+    parser.add_argument('--compare', metavar='REFERENCE', help="Résultats JSON d'une version précédente")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    elif not args.compare:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# bench_segmentation.py
+#
+# Compare le découpage en phrases historique (expression régulière sur la
+# ponctuation finale) au segmenteur français, sur des livres entiers : durée
+# du découpage, nombre de phrases et de fragments courts, et nombre de
+# requêtes de synthèse après regroupement en blocs.
+#
+#   python benchmarks/bench_segmentation.py livre.epub autre.pdf -o resultats.json
+#   python benchmarks/bench_segmentation.py --compare resultats_precedents.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epub_processor import analyze_document
+from text_segmentation import split_sentences, iter_sentences, pack_sentences, ABBREVIATIONS, MIN_SENTENCE_CHARS
+from bench_analysis import git_commit, measure
+from synthetic_corpus import make_epub
+
+SEGMENTERS = {
+    'regex': split_sentences,
+    'french': iter_sentences,
+}
+
+def count_abbreviation_splits(sentences):
+    """
+    Nombre de phrases se terminant par une abréviation (« M. », « p. »...), c'est-à-dire de coupures erronées.
+    """
+    count = 0
+    for sentence in sentences:
+        words = sentence.rstrip().split()
+        if words and words[-1].endswith('.') and words[-1][:-1].lower() in ABBREVIATIONS:
+            count += 1
+    return count
+
+def bench_book(texts, repeat, max_chars_values):
+    results = {}
+    for name, segmenter in SEGMENTERS.items():
+        sentences, stats = measure(lambda: [list(segmenter(text)) for text in texts], repeat)
+        flat = [sentence.strip() for chapter in sentences for sentence in chapter if sentence.strip()]
+        stats.update({
+            'sentences': len(flat),
+            'short_fragments': sum(1 for sentence in flat if len(sentence) < MIN_SENTENCE_CHARS),
+            'abbreviation_splits': count_abbreviation_splits(flat),
+            'requests': {str(max_chars): sum(len(pack_sentences(chapter, max_chars)) for chapter in sentences)
+                         for max_chars in max_chars_values},
+        })
+        results[name] = stats
+    return results
+
+def load_books(args, corpus_dir):
+    books = {}
+    for path in args.inputs:
+        books[os.path.basename(path)] = [chapter.content for chapter in analyze_document(path)]
+    if not books:
+        path = os.path.join(corpus_dir, 'synthetique.epub')
+        make_epub(path, chapters=args.chapters, chapter_kb=args.chapter_kb, seed=args.seed)
+        books[f'synthetique_{args.chapters}x{args.chapter_kb}k'] = [
+            chapter.content for chapter in analyze_document(path, use_cache=False)]
+    return books
+
+def compare(baseline, current):
+    print(f"Référence : {baseline.get('commit')}  Actuel : {current.get('commit')}")
+    for book, result in current['books'].items():
+        for name, stats in result['segmenters'].items():
+            base = baseline.get('books', {}).get(book, {}).get('segmenters', {}).get(name)
+            if base:
+                print(f"{book} / {name}: {base['seconds_median']:.4f}s -> {stats['seconds_median']:.4f}s, "
+                      f"requêtes {base['requests']} -> {stats['requests']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare les découpages en phrases sur des livres entiers.")
+    parser.add_argument('inputs', nargs='*', help="Livres ePub/PDF (un livre synthétique par défaut)")
+    parser.add_argument('--chapters', type=int, default=50)
+    parser.add_argument('--chapter-kb', type=int, default=50)
+    parser.add_argument('--max-chars', type=int, nargs='+', default=[300, 1000],
+                        help="Tailles de blocs pour le décompte des requêtes (sans regroupement, une requête par phrase)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help="Fichier JSON de résultats (sortie standard par défaut)")
+    parser.add_argument('--compare', metavar='REFERENCE', help="Résultats JSON d'une version précédente")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='bench_segmentation_') as corpus_dir:
+        books = load_books(args, corpus_dir)
+    results = {
+        'benchmark': 'segmentation',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'time': round(time.time(), 3),
+        'repeat': args.repeat,
+        'books': {name: {'characters': sum(map(len, texts)),
+                         'segmenters': bench_book(texts, args.repeat, args.max_chars)}
+                  for name, texts in books.items()},
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    elif not args.compare:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# bench_sessions.py
+#
+# Mesure le débit de synthèse du moteur edge contre le serveur factice local,
+# avec une connexion websocket par requête (pool_size=0) puis avec le lot de
+# connexions réutilisées. La latence de poignée de main simule le coût de
+# l'ouverture d'une connexion TLS vers le service.
+#
+#   python benchmarks/bench_sessions.py --requests 500 --handshake-latency 0.15 -o resultats.json
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_backends import EdgeTTSBackend
+from bench_analysis import git_commit
+from fake_tts_server import FakeTTSServer
+
+SENTENCE = "Le lendemain, M. Dupont reprit la route de Lyon avant le lever du jour."
+
+async def bench_pool(url, pool_size, requests, concurrency):
+    backend = EdgeTTSBackend(url=url, pool_size=pool_size)
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with slots:
+            started = time.perf_counter()
+            await backend.synthesize_bytes(f"{SENTENCE} ({i})", 'fr-FR-DeniseNeural')
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(one(i) for i in range(requests)))
+    finally:
+        await backend.aclose()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(requests / elapsed, 2),
+        'latency_median': round(latencies[len(latencies) // 2], 4),
+        'latency_p95': round(latencies[int(len(latencies) * 0.95) - 1], 4),
+        'pool': backend.pool.stats(),
+    }
+
+async def run(args):
+    server = FakeTTSServer(handshake_latency=args.handshake_latency, latency=args.latency)
+    url = await server.start()
+    try:
+        cases = {}
+        for pool_size in (0, args.pool_size):
+            cases[f'pool_{pool_size}'] = await bench_pool(url, pool_size, args.requests, args.concurrency)
+    finally:
+        await server.stop()
+    return cases
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare une connexion par requête et le lot de connexions.")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--handshake-latency', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('-o', '--output', help="Fichier JSON de résultats (sortie standard par défaut)")
+    args = parser.parse_args(argv)
+
+    results = {
+        'benchmark': 'sessions',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'time': round(time.time(), 3),
+        'settings': {key: getattr(args, key) for key in
+                     ('requests', 'concurrency', 'pool_size', 'handshake_latency', 'latency')},
+        'cases': asyncio.run(run(args)),
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
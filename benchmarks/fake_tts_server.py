@@ -0,0 +1,164 @@
+# fake_tts_server.py
+#
+# Serveur websocket local imitant le protocole du service de synthèse Edge :
+# configuration (speech.config), requêtes SSML, puis turn.start, messages
+# audio binaires (longueur des en-têtes sur deux octets, en-têtes, trames
+# MP3 silencieuses) et turn.end. Il permet de tester et de mesurer le lot de
+# connexions (tts_sessions) sans réseau :
+#
+#   python benchmarks/fake_tts_server.py --port 8765 --handshake-latency 0.15
+#   python cli.py livre.epub --tts-url ws://127.0.0.1:8765/tts
+
+import os
+import re
+import sys
+import json
+import math
+import random
+import asyncio
+import logging
+import argparse
+from xml.sax.saxutils import unescape
+
+from aiohttp import web, WSMsgType
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tts_backends import SilenceBackend
+from tts_sessions import parse_headers, date_to_string
+
+TEXT_PATTERN = re.compile(r"<prosody[^>]*>(.*)</prosody>", re.S)
+RATE_PATTERN = re.compile(r"rate='([+-]\d+)%'")
+FRAMES_PER_MESSAGE = 32
+
+def audio_message(request_id, data, content_type='audio/mpeg'):
+    headers = f"X-RequestId:{request_id}\r\n"
+    if content_type:
+        headers += f"Content-Type:{content_type}\r\n"
+    headers += f"X-StreamId:{request_id}\r\nPath:audio\r\n"
+    encoded = headers.encode('utf-8')
+    return len(encoded).to_bytes(2, 'big') + encoded + data
+
+def text_message(request_id, path, body=''):
+    return (f"X-RequestId:{request_id}\r\nContent-Type:application/json; charset=utf-8\r\n"
+            f"X-Timestamp:{date_to_string()}\r\nPath:{path}\r\n\r\n{body}")
+
+class FakeTTSServer:
+    """
+    Serveur de synthèse factice.
+
+    :param handshake_latency: Délai ajouté à l'ouverture de chaque connexion (coût de la poignée de main TLS)
+    :param latency: Délai avant la réponse à chaque requête SSML
+    :param max_turns: Nombre de requêtes après lequel le serveur ferme la connexion (None : illimité)
+    :param drop_rate: Probabilité de couper la connexion au lieu de répondre à une requête
+    """
+    def __init__(self, handshake_latency=0.0, latency=0.0, max_turns=None, drop_rate=0.0, seed=None):
+        self.handshake_latency = handshake_latency
+        self.latency = latency
+        self.max_turns = max_turns
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.silence = SilenceBackend()
+        self.connections = 0
+        self.requests = 0
+        self.drops = 0
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request):
+        await asyncio.sleep(self.handshake_latency)
+        ws = web.WebSocketResponse(compress=True)
+        await ws.prepare(request)
+        self.connections += 1
+        configured = False
+        turns = 0
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            headers, body = parse_headers(message.data.encode('utf-8'))
+            path = headers.get(b"Path")
+            if path == b"speech.config":
+                configured = True
+                continue
+            if path != b"ssml" or not configured:
+                await ws.close(code=1008, message=b"unexpected message")
+                break
+            if self.drop_rate and self.random.random() < self.drop_rate:
+                self.drops += 1
+                await ws.close()
+                break
+            try:
+                await self.respond(ws, headers.get(b"X-RequestId", b"").decode(), body.decode('utf-8'))
+            except ConnectionResetError:
+                break  # Client parti pendant la réponse (annulation)
+            turns += 1
+            if self.max_turns is not None and turns >= self.max_turns:
+                await ws.close()
+                break
+        return ws
+
+    async def respond(self, ws, request_id, ssml):
+        self.requests += 1
+        match = TEXT_PATTERN.search(ssml)
+        text = unescape(match.group(1)) if match else ''
+        rate = RATE_PATTERN.search(ssml)
+        frames = max(1, math.ceil(self.silence.duration(text, f"{rate.group(1) if rate else '+0'}%")
+                                  / SilenceBackend.FRAME_SECONDS))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        await ws.send_str(text_message(request_id, 'turn.start', json.dumps({'context': {'serviceTag': 'fake'}})))
+        for start in range(0, frames, FRAMES_PER_MESSAGE):
+            count = min(FRAMES_PER_MESSAGE, frames - start)
+            await ws.send_bytes(audio_message(request_id, self.silence._frame * count))
+        # Fin du flux audio : message binaire sans type de contenu ni données
+        await ws.send_bytes(audio_message(request_id, b'', content_type=None))
+        await ws.send_str(text_message(request_id, 'turn.end', '{}'))
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application()
+        app.router.add_get('/tts', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"ws://{host}:{self.port}/tts"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def stats(self):
+        return {'connections': self.connections, 'requests': self.requests, 'drops': self.drops}
+
+async def serve(args):
+    server = FakeTTSServer(handshake_latency=args.handshake_latency, latency=args.latency,
+                           max_turns=args.max_turns, drop_rate=args.drop_rate, seed=args.seed)
+    url = await server.start(args.host, args.port)
+    print(f"Serveur de synthèse factice : {url}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serveur websocket local imitant le service de synthèse Edge.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--handshake-latency', type=float, default=0.0,
+                        help="Délai à l'ouverture de chaque connexion, en secondes")
+    parser.add_argument('--latency', type=float, default=0.0, help="Délai avant chaque réponse, en secondes")
+    parser.add_argument('--max-turns', type=int, help="Requêtes par connexion avant fermeture par le serveur")
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help="Probabilité de couper la connexion au lieu de répondre")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
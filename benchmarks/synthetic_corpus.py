@@ -0,0 +1,161 @@
+# synthetic_corpus.py
+#
+# Génération hors ligne de livres synthétiques (ePub et PDF) pour les mesures
+# de performance. Le contenu est déterministe pour une graine donnée.
+
+import random
+import zipfile
+
+WORDS = (
+    "le la les un une des et ou mais donc or ni car que qui dans sur sous avec sans pour par "
+    "maison jardin rivière village soleil nuit matin soir chemin forêt montagne lettre livre "
+    "homme femme enfant ami voisin docteur capitaine marchand voyageur roi reine "
+    "regarde marche parle attend revient pense écrit lit répond entend découvre oublie "
+    "grand petit vieux jeune calme sombre lumineux étrange heureux inquiet lointain"
+).split()
+
+SENTENCE_TEMPLATES = (
+    "{}.",
+    "{} !",
+    "{} ?",
+    "M. Dupont {}.",
+    "« {} », dit-elle.",
+    "{}, etc.",
+    "{}… puis plus rien.",
+    "Voir p. 12, cf. {}.",
+)
+
+def make_sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 24))]
+    words[0] = words[0].capitalize()
+    return rng.choice(SENTENCE_TEMPLATES).format(' '.join(words))
+
+def make_paragraph(rng):
+    return ' '.join(make_sentence(rng) for _ in range(rng.randint(3, 8)))
+
+def make_paragraphs(rng, size):
+    """
+    Retourne des paragraphes dont la taille totale atteint au moins size caractères.
+    """
+    paragraphs, total = [], 0
+    while total < size:
+        paragraph = make_paragraph(rng)
+        paragraphs.append(paragraph)
+        total += len(paragraph)
+    return paragraphs
+
+def escape_xml(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def make_epub(path, chapters=20, chapter_kb=50, seed=0):
+    """
+    Écrit un ePub 2 de chapters chapitres, chacun dans son propre fichier XHTML
+    d'environ chapter_kb Ko, avec OPF, NCX et une image.
+    """
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip')
+        archive.writestr('META-INF/container.xml',
+                         '<?xml version="1.0"?><container version="1.0" '
+                         'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+                         '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                         '</rootfiles></container>')
+        manifest = ''.join(f'<item id="c{i}" href="Text/chapitre{i}.xhtml" media-type="application/xhtml+xml"/>'
+                           for i in range(chapters))
+        spine = ''.join(f'<itemref idref="c{i}"/>' for i in range(chapters))
+        archive.writestr('OEBPS/content.opf',
+                         '<?xml version="1.0" encoding="utf-8"?>'
+                         '<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="id">'
+                         '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>Livre synthétique</dc:title>'
+                         '<dc:identifier id="id">synthetique</dc:identifier><dc:language>fr</dc:language></metadata>'
+                         '<manifest><item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>'
+                         f'{manifest}<item id="img" href="Images/couverture.jpg" media-type="image/jpeg"/></manifest>'
+                         f'<spine toc="ncx">{spine}</spine></package>')
+        nav_points = ''.join(f'<navPoint id="n{i}" playOrder="{i + 1}"><navLabel><text>Chapitre {i + 1}</text>'
+                             f'</navLabel><content src="Text/chapitre{i}.xhtml"/></navPoint>'
+                             for i in range(chapters))
+        archive.writestr('OEBPS/toc.ncx',
+                         '<?xml version="1.0" encoding="utf-8"?>'
+                         '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">'
+                         f'<head/><docTitle><text>Livre synthétique</text></docTitle><navMap>{nav_points}</navMap></ncx>')
+        for i in range(chapters):
+            body = ''.join(f'<p>{escape_xml(paragraph)}</p>'
+                           for paragraph in make_paragraphs(rng, chapter_kb * 1024))
+            archive.writestr(f'OEBPS/Text/chapitre{i}.xhtml',
+                             '<?xml version="1.0" encoding="utf-8"?>'
+                             '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Chapitre</title>'
+                             '<style>p { text-indent: 1em; }</style></head>'
+                             f'<body><h1>Chapitre {i + 1}</h1>{body}</body></html>')
+        archive.writestr('OEBPS/Images/couverture.jpg', bytes(rng.getrandbits(8) for _ in range(4096)))
+
+def escape_pdf(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def make_pdf(path, pages=50, chapter_every=10, seed=0):
+    """
+    Écrit un PDF de pages pages en Helvetica : un titre en 24 points toutes les
+    chapter_every pages, des intertitres en 14 points et le corps en 11 points.
+    """
+    rng = random.Random(seed)
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    }
+    page_ids = []
+    chapter = 0
+    for page in range(pages):
+        lines = []
+        if page % chapter_every == 0:
+            chapter += 1
+            lines.append((24, f"Chapitre {chapter}"))
+        elif rng.random() < 0.3:
+            lines.append((14, ' '.join(rng.choice(WORDS) for _ in range(4)).capitalize()))
+        words = []
+        while len(lines) < 45:
+            words.append(rng.choice(WORDS))
+            if len(' '.join(words)) > 80:
+                lines.append((11, ' '.join(words)))
+                words = []
+
+        stream = ['BT', '/F1 11 Tf', '14 TL', '72 770 Td']
+        for size, text in lines:
+            stream.append(f'/F1 {size} Tf ({escape_pdf(text)}) Tj T*')
+        stream.append('ET')
+        content = '\n'.join(stream).encode('cp1252')
+
+        content_id = 4 + 2 * page
+        page_id = content_id + 1
+        objects[content_id] = b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream'
+        objects[page_id] = (b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_id)
+        page_ids.append(page_id)
+    kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids).encode()
+    objects[2] = b'<< /Type /Pages /Kids [' + kids + b'] /Count %d >>' % len(page_ids)
+
+    output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += b'%d 0 obj\n' % object_id + objects[object_id] + b'\nendobj\n'
+    xref = len(output)
+    size = max(objects) + 1
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % size
+    for object_id in range(1, size):
+        output += b'%010d 00000 n \n' % offsets[object_id]
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, xref)
+    with open(path, 'wb') as f:
+        f.write(output)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Génère un livre synthétique pour les mesures de performance.")
+    parser.add_argument('output', help="Fichier à écrire (.epub ou .pdf)")
+    parser.add_argument('--chapters', type=int, default=20)
+    parser.add_argument('--chapter-kb', type=int, default=50)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.output.lower().endswith('.pdf'):
+        make_pdf(args.output, pages=args.pages, seed=args.seed)
+    else:
+        make_epub(args.output, chapters=args.chapters, chapter_kb=args.chapter_kb, seed=args.seed)
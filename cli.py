@@ -0,0 +1,184 @@
+# cli.py
+#
+# Conversion en ligne de commande, sans interface graphique : ce module ne doit
+# importer ni tkinter, ni PIL, ni pygame, afin de fonctionner sur des serveurs.
+
+import os
+import sys
+import glob
+import json
+import time
+import asyncio
+import logging
+import argparse
+from epub_processor import analyze_document
+from text_to_speech import SUPPORTED_VOICES, DEFAULT_SENTENCE_ATTEMPTS
+from conversion_pipeline import ChapterPipeline, DEFAULT_CHAPTER_CONCURRENCY, DEFAULT_REQUEST_CONCURRENCY
+from tts_backends import BACKENDS, get_backend
+from metrics import ConversionMetrics, write_atomic
+from utils import get_filename_without_extension, sanitize_filename
+from job_journal import clean_stale_job_dirs
+
+# Codes de sortie
+EXIT_OK = 0
+EXIT_FAILURES = 1  # Au moins un livre ou un chapitre n'a pas pu être converti
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+SUPPORTED_EXTENSIONS = ('.epub', '.pdf')
+
+def emit(event, **fields):
+    """
+    Écrit un événement sous forme d'une ligne JSON sur la sortie standard.
+    """
+    record = {'event': event, 'time': round(time.time(), 3)}
+    record.update(fields)
+    sys.stdout.write(json.dumps(record, ensure_ascii=False) + '\n')
+    sys.stdout.flush()
+
+def expand_inputs(patterns):
+    """
+    Développe les fichiers et motifs glob passés en argument, sans doublons et dans l'ordre.
+    """
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if path.lower().endswith(SUPPORTED_EXTENSIONS) and path not in files:
+                files.append(path)
+    return files
+
+async def convert_book(file_path, args, backend, metrics):
+    """
+    Analyse puis convertit un livre. Retourne True si tous les chapitres ont été convertis.
+
+    :param metrics: Mesures de la synthèse de ce livre (metrics.ConversionMetrics)
+    """
+    emit('book_started', file=file_path)
+    started = time.monotonic()
+    try:
+        chapitres = analyze_document(file_path, max_workers=args.analysis_workers or None,
+                                     use_cache=not args.no_analysis_cache)
+    except Exception as e:
+        logging.error(f"Erreur lors de l'analyse de {file_path} : {e}")
+        emit('book_failed', file=file_path, stage='analysis', error=str(e))
+        return False
+    chapitres = [chapitre for chapitre in chapitres if chapitre.content.strip()]
+    emit('book_analyzed', file=file_path, chapters=len(chapitres),
+         words=sum(len(chapitre.content.split()) for chapitre in chapitres),
+         seconds=round(time.monotonic() - started, 3))
+    if not chapitres:
+        emit('book_failed', file=file_path, stage='analysis', error="Aucun chapitre détecté")
+        return False
+
+    output_dir = os.path.join(args.output, sanitize_filename(get_filename_without_extension(file_path)))
+    os.makedirs(output_dir, exist_ok=True)
+
+    def on_event(event, index, details):
+        emit(event, file=file_path, chapter=index, title=chapitres[index - 1].title, **details)
+
+    pipeline = ChapterPipeline(
+        output_dir, voice_index=args.voice, rate=args.rate, volume=args.volume,
+        chapter_concurrency=args.chapters_in_parallel, request_concurrency=args.concurrency,
+        max_attempts=args.max_attempts, sentence_attempts=args.sentence_attempts,
+        job_name=os.path.abspath(file_path), stream=args.stream,
+        backend=backend, metrics=metrics,
+        on_message=logging.info,
+        on_progress=lambda value: emit('progress', file=file_path, percent=round(value, 1)),
+        on_event=on_event)
+    metrics.start()
+    failed_attempts = await pipeline.run(chapitres)
+    metrics.stop()
+
+    emit('book_finished', file=file_path, output_dir=output_dir,
+         chapters=len(chapitres), failed_chapters=sorted(failed_attempts),
+         seconds=round(time.monotonic() - started, 3), rate=pipeline.rate_controller.state(),
+         metrics=metrics.summary())
+    return not failed_attempts
+
+async def run(files, args):
+    # L'adresse du service ne concerne que le moteur edge (serveur local de test par exemple)
+    backend = get_backend(args.backend, **({'url': args.tts_url} if args.tts_url and args.backend == 'edge' else {}))
+    all_ok = True
+    books = {}
+    total = ConversionMetrics()
+    total.stop()  # La durée totale est la somme des durées des livres
+    try:
+        for file_path in files:
+            metrics = ConversionMetrics()
+            all_ok = await convert_book(file_path, args, backend, metrics) and all_ok
+            books[file_path] = metrics.summary()
+            total.merge(metrics)
+            # Fichiers réécrits après chaque livre : les mesures restent lisibles pendant un long lot
+            write_metrics(args, books, total)
+    finally:
+        await backend.aclose()
+    return all_ok
+
+def write_metrics(args, books, total):
+    if args.metrics_json:
+        write_atomic(args.metrics_json, json.dumps({'books': books, 'total': total.summary()},
+                                                   ensure_ascii=False, indent=2) + '\n')
+    if args.metrics_prom:
+        total.write_prometheus(args.metrics_prom, labels={'backend': args.backend})
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Convertit des fichiers ePub et PDF en livres audio, sans interface graphique. "
+                    "La progression est écrite sur la sortie standard, une ligne JSON par événement.")
+    parser.add_argument('inputs', nargs='+', help="Fichiers ePub/PDF ou motifs glob (ex. 'livres/**/*.epub')")
+    parser.add_argument('-o', '--output', required=True, help="Dossier de destination")
+    parser.add_argument('--voice', type=int, default=4, choices=sorted(SUPPORTED_VOICES),
+                        help="Index de la voix : " + ", ".join(f"{k}={v}" for k, v in SUPPORTED_VOICES.items()))
+    parser.add_argument('--rate', type=int, default=0, help="Variation du débit en pourcentage (ex. -10, 20)")
+    parser.add_argument('--volume', type=int, default=0, help="Variation du volume en pourcentage")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_REQUEST_CONCURRENCY,
+                        help="Nombre maximal de requêtes de synthèse simultanées (la limite effective s'adapte en dessous)")
+    parser.add_argument('--chapters-in-parallel', type=int, default=DEFAULT_CHAPTER_CONCURRENCY,
+                        help="Nombre de chapitres synthétisés simultanément")
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help="Nombre de tentatives par chapitre avant abandon")
+    parser.add_argument('--sentence-attempts', type=int, default=DEFAULT_SENTENCE_ATTEMPTS,
+                        help="Nombre de tentatives par phrase avant l'échec du chapitre")
+    parser.add_argument('--analysis-workers', type=int, default=1,
+                        help="Processus utilisés pour analyser les gros ePub et PDF (0 : un par cœur)")
+    parser.add_argument('--no-analysis-cache', action='store_true',
+                        help="Analyser de nouveau les livres au lieu de réutiliser le cache d'analyse")
+    parser.add_argument('--stream', action='store_true',
+                        help="Écrire l'audio directement dans le fichier du chapitre")
+    parser.add_argument('--backend', default='edge', choices=sorted(BACKENDS),
+                        help="Moteur de synthèse ('silence' fonctionne hors ligne, pour les tests et mesures)")
+    parser.add_argument('--tts-url', help="Adresse websocket du service de synthèse du moteur edge "
+                                          "(ex. ws://127.0.0.1:8765/tts avec benchmarks/fake_tts_server.py)")
+    parser.add_argument('--metrics-json', metavar='FICHIER',
+                        help="Écrire un résumé JSON des mesures (latences, débits, nouvelles tentatives) par livre")
+    parser.add_argument('--metrics-prom', metavar='FICHIER',
+                        help="Écrire les mesures au format texte Prometheus (ex. dossier textfile de node_exporter, "
+                             "fichier en .prom)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Afficher les journaux détaillés sur la sortie d'erreur")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    files = expand_inputs(args.inputs)
+    missing = [path for path in files if not os.path.isfile(path)]
+    if not files or missing:
+        emit('error', error="Aucun fichier ePub ou PDF trouvé" if not files else "Fichiers introuvables",
+             files=missing)
+        return EXIT_USAGE
+
+    emit('started', files=files, output=args.output)
+    clean_stale_job_dirs()
+    try:
+        all_ok = asyncio.run(run(files, args))
+    except KeyboardInterrupt:
+        emit('interrupted')
+        return EXIT_INTERRUPTED
+    emit('finished', success=all_ok)
+    return EXIT_OK if all_ok else EXIT_FAILURES
+
+if __name__ == "__main__":
+    sys.exit(main())
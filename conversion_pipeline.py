@@ -0,0 +1,197 @@
+# conversion_pipeline.py
+
+import asyncio
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from text_to_speech import text_to_speech, run_bounded, DEFAULT_SENTENCE_ATTEMPTS
+from rate_controller import AdaptiveRateController, DEFAULT_INITIAL_LIMIT
+from tts_backends import get_backend
+from metrics import ConversionMetrics
+
+# Nombre de chapitres synthétisés simultanément
+DEFAULT_CHAPTER_CONCURRENCY = 3
+# Plafond global de requêtes de synthèse simultanées, partagé par tous les chapitres ;
+# le contrôleur adaptatif ajuste la limite effective en dessous
+DEFAULT_REQUEST_CONCURRENCY = 8
+# Pause minimale avant de réessayer un chapitre en échec (secondes)
+CHAPTER_RETRY_DELAY = 5
+# Nombre de fusions audio pouvant s'exécuter en parallèle
+DEFAULT_MERGE_WORKERS = 2
+
+class ChapterPipeline:
+    """
+    Ordonnanceur de conversion : plusieurs chapitres sont synthétisés en même temps
+    sous un contrôleur de débit commun, et les fusions ffmpeg s'exécutent dans un
+    pool de threads pendant que la synthèse des chapitres suivants continue.
+    """
+    def __init__(self, output_dir, voice_index=4, rate=0, volume=0,
+                 chapter_concurrency=DEFAULT_CHAPTER_CONCURRENCY,
+                 request_concurrency=DEFAULT_REQUEST_CONCURRENCY,
+                 merge_workers=DEFAULT_MERGE_WORKERS,
+                 max_attempts=None, sentence_attempts=DEFAULT_SENTENCE_ATTEMPTS, job_name=None, stream=False,
+                 rate_controller=None, backend=None, metrics=None, on_message=None, on_progress=None, on_event=None, should_stop=None):
+        self.output_dir = output_dir
+        self.voice_index = voice_index
+        self.rate = rate
+        self.volume = volume
+        self.chapter_concurrency = max(1, chapter_concurrency)
+        self.request_concurrency = max(1, request_concurrency)
+        self.merge_workers = max(1, merge_workers)
+        self.max_attempts = max_attempts  # None : réessayer jusqu'à l'arrêt demandé
+        self.sentence_attempts = sentence_attempts  # Tentatives par phrase avant l'échec du chapitre
+        self.job_name = job_name  # Identifiant du livre, pour la reprise entre processus
+        self.stream = stream  # Écriture directe de l'audio dans le fichier du chapitre
+        # Contrôleur fourni par l'appelant pour partager le débit entre plusieurs livres ;
+        # sinon un contrôleur plafonné à request_concurrency est créé à chaque exécution
+        self.shared_rate_controller = rate_controller
+        self.rate_controller = rate_controller
+        self.backend = backend  # Moteur de synthèse (Edge TTS si None)
+        # Latences, débits, nouvelles tentatives et durées des chapitres (metrics.ConversionMetrics)
+        self.metrics = metrics or ConversionMetrics()
+        self.on_message = on_message or logging.info
+        self.on_progress = on_progress or (lambda value: None)
+        # Événements structurés : on_event(nom, index_chapitre, détails)
+        self.on_event = on_event or (lambda event, index, details: None)
+        self.should_stop = should_stop or (lambda: False)
+        self.failed_attempts = {}  # Nombre d'échecs par chapitre encore en échec
+        # Annulation demandée par cancel() (depuis n'importe quel thread) et tâche à annuler
+        self.cancelled = False
+        self._loop = None
+        self._task = None
+
+    def chapter_file_name(self, index, total_chapters):
+        chapter_number = str(index).zfill(len(str(total_chapters)))
+        return f"chapitre_{chapter_number}.mp3"
+
+    def cancel(self):
+        """
+        Interrompt la conversion ; peut être appelée depuis n'importe quel thread, y compris
+        avant run(). Les synthèses en cours sont annulées et les connexions fermées ; les
+        segments déjà synthétisés restent dans les dossiers temporaires pour une reprise.
+        """
+        self.cancelled = True
+        loop, task = self._loop, self._task
+        if loop is not None and task is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(task.cancel)
+
+    def stopping(self):
+        return self.cancelled or self.should_stop()
+
+    async def run(self, chapitres):
+        """
+        Convertit tous les chapitres et retourne le dictionnaire des chapitres
+        toujours en échec avec leur nombre de tentatives. Après cancel(), retourne
+        dès l'annulation effective, avec self.cancelled à True.
+        """
+        self.failed_attempts = {}
+        if self.cancelled:
+            return self.failed_attempts
+        # Tâche distincte : cancel() n'interrompt que la conversion, pas l'appelant
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.ensure_future(self._run(chapitres))
+        try:
+            return await self._task
+        except asyncio.CancelledError:
+            if not (self.cancelled and self._task.cancelled()):
+                raise  # Annulation venue de l'appelant
+            self.on_message("Conversion annulée ; les segments déjà synthétisés sont conservés pour la reprise.")
+            return self.failed_attempts
+        finally:
+            self._task = None
+
+    async def _run(self, chapitres):
+        total_chapters = len(chapitres)
+        if not total_chapters:
+            return self.failed_attempts
+
+        self.rate_controller = self.shared_rate_controller or AdaptiveRateController(
+            initial_limit=min(DEFAULT_INITIAL_LIMIT, self.request_concurrency), max_limit=self.request_concurrency)
+        # Un seul moteur (et donc un seul lot de connexions) pour tous les chapitres
+        backend = self.backend or get_backend()
+        chapter_slots = asyncio.Semaphore(self.chapter_concurrency)
+        finished = []
+
+        def report_progress():
+            self.on_progress(len(finished) / total_chapters * 100)
+
+        # Pas de bloc with : à l'annulation, on n'attend pas la fin des fusions déjà commencées
+        merge_executor = ThreadPoolExecutor(max_workers=self.merge_workers, thread_name_prefix="merge")
+        cancelled = False
+        try:
+            async def convert(i, chapitre):
+                if not chapitre.content.strip():
+                    self.on_message(f"Chapitre {i} vide, ignoré.")
+                    self.on_event('chapter_skipped', i, {})
+                    finished.append(i)
+                    report_progress()
+                    return
+
+                chapter_name = self.chapter_file_name(i, total_chapters)
+                output_file = os.path.join(self.output_dir, chapter_name)
+                attempts = 0
+
+                while not self.stopping():
+                    if attempts > 0:
+                        # Courte pause avant de réessayer ce chapitre, prolongée si le contrôleur
+                        # de débit a suspendu les requêtes après des erreurs
+                        pause_time = round(max(CHAPTER_RETRY_DELAY, self.rate_controller.cooldown_remaining()))
+                        self.on_message(f"Tentative #{attempts+1} pour le chapitre {i} après une pause de {pause_time} secondes...")
+                        await asyncio.sleep(pause_time)
+                        if self.stopping():
+                            break
+
+                    async with chapter_slots:
+                        if self.stopping():
+                            break
+                        chapter_started = time.monotonic()
+                        try:
+                            self.on_message(f"Conversion du chapitre {i}/{total_chapters}...")
+                            self.on_event('chapter_started', i, {'attempt': attempts + 1})
+                            await text_to_speech(chapitre.content, voice_index=self.voice_index,
+                                                 rate=self.rate, volume=self.volume,
+                                                 output_file=output_file, chapter_title=chapitre.title,
+                                                 rate_controller=self.rate_controller, merge_executor=merge_executor,
+                                                 job_id=f"{self.job_name}#{i}", stream=self.stream,
+                                                 backend=backend, sentence_attempts=self.sentence_attempts,
+                                                 metrics=self.metrics)
+                        except Exception as e:
+                            self.metrics.observe_chapter(time.monotonic() - chapter_started, ok=False)
+                            attempts += 1
+                            self.failed_attempts[i] = attempts
+                            error_message = f"Échec de la conversion du chapitre {i} : {str(e)}"
+                            logging.error(error_message)
+                            self.on_message(error_message)
+                            self.on_event('chapter_failed', i, {'attempt': attempts, 'error': str(e)})
+                            if self.max_attempts is not None and attempts >= self.max_attempts:
+                                self.on_message(f"Abandon du chapitre {i} après {attempts} tentatives")
+                                return
+                            self.on_message(f"Le chapitre {i} sera réessayé plus tard (échec #{attempts})")
+                            continue
+
+                        self.metrics.observe_chapter(time.monotonic() - chapter_started, ok=True)
+
+                    # Retirer ce chapitre des échecs s'il était présent
+                    self.failed_attempts.pop(i, None)
+                    finished.append(i)
+                    report_progress()
+                    self.on_message(f"Chapitre {i}/{total_chapters} converti avec succès en tant que {chapter_name}")
+                    self.on_event('chapter_done', i, {'output_file': output_file})
+                    return
+
+            try:
+                await run_bounded(convert(i, chapitre) for i, chapitre in enumerate(chapitres, start=1))
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                if self.backend is None:
+                    await backend.aclose()
+        finally:
+            # À l'annulation, les fusions en attente sont abandonnées et celles déjà commencées
+            # se terminent en arrière-plan (le fichier n'est publié que complet, et la fusion
+            # est notée dans le journal pour ne pas être refaite à la reprise)
+            merge_executor.shutdown(wait=not cancelled, cancel_futures=cancelled)
+
+        return self.failed_attempts
@@ -0,0 +1,363 @@
+# conversion_queue.py
+#
+# File d'attente persistante de livres à convertir (SQLite) et processus de
+# travail qui la consomme en continu. Comme cli.py, ce module n'importe aucune
+# dépendance graphique.
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from epub_processor import analyze_document
+from text_to_speech import SUPPORTED_VOICES, DEFAULT_SENTENCE_ATTEMPTS
+from conversion_pipeline import ChapterPipeline, DEFAULT_CHAPTER_CONCURRENCY, DEFAULT_REQUEST_CONCURRENCY
+from tts_backends import BACKENDS, get_backend
+from rate_controller import AdaptiveRateController, DEFAULT_INITIAL_LIMIT
+from metrics import ConversionMetrics
+from utils import get_filename_without_extension, sanitize_filename
+from cli import emit, expand_inputs
+from job_journal import clean_stale_job_dirs
+
+DEFAULT_QUEUE_PATH = os.path.join(Path.home(), '.audiobook_cache', 'queue.sqlite3')
+DEFAULT_BOOKS_IN_PARALLEL = 2
+DEFAULT_POLL_INTERVAL = 5  # secondes entre deux consultations d'une file vide
+HEARTBEAT_INTERVAL = 30  # secondes
+STALE_AFTER = 300  # une tâche sans signe de vie depuis ce délai est remise en file
+
+# États d'une tâche
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    input_path TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    error TEXT,
+    chapters INTEGER,
+    failed_chapters TEXT,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL,
+    analysis_seconds REAL,
+    synthesis_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+class ConversionQueue:
+    """
+    File de tâches de conversion stockée dans une base SQLite (mode WAL),
+    partageable entre plusieurs processus sur la même machine.
+    """
+    def __init__(self, db_path=DEFAULT_QUEUE_PATH):
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, input_path, output_dir, **settings):
+        cursor = self.conn.execute(
+            "INSERT INTO jobs (input_path, output_dir, settings, enqueued_at) VALUES (?, ?, ?, ?)",
+            (os.path.abspath(input_path), os.path.abspath(output_dir), json.dumps(settings), time.time()))
+        return cursor.lastrowid
+
+    def claim_next(self, worker_id):
+        """
+        Réserve atomiquement la plus ancienne tâche en attente et la retourne (ou None).
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (QUEUED,)).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, started_at = ?, "
+                "heartbeat_at = ?, error = NULL WHERE id = ?",
+                (RUNNING, worker_id, now, now, row['id']))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        job = dict(row)
+        job['settings'] = json.loads(job['settings'])
+        return job
+
+    def heartbeat(self, job_ids):
+        if job_ids:
+            now = time.time()
+            self.conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", [(now, job_id) for job_id in job_ids])
+
+    def requeue_stale(self, stale_after=STALE_AFTER):
+        """
+        Remet en file les tâches dont le processus de travail a disparu sans les terminer.
+        """
+        cursor = self.conn.execute(
+            "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ?",
+            (QUEUED, RUNNING, time.time() - stale_after))
+        return cursor.rowcount
+
+    def requeue(self, job_id):
+        self.conn.execute("UPDATE jobs SET status = ?, worker = NULL WHERE id = ?", (QUEUED, job_id))
+
+    def record_analysis(self, job_id, chapters, seconds):
+        self.conn.execute("UPDATE jobs SET chapters = ?, analysis_seconds = ? WHERE id = ?",
+                          (chapters, seconds, job_id))
+
+    def finish(self, job_id, failed_chapters, synthesis_seconds):
+        status = FAILED if failed_chapters else DONE
+        error = f"Chapitres en échec : {failed_chapters}" if failed_chapters else None
+        self.conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, failed_chapters = ?, synthesis_seconds = ?, "
+            "finished_at = ? WHERE id = ?",
+            (status, error, json.dumps(failed_chapters), synthesis_seconds, time.time(), job_id))
+
+    def fail(self, job_id, error):
+        self.conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                          (FAILED, error, time.time(), job_id))
+
+    def list_jobs(self, status=None):
+        if status:
+            rows = self.conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,))
+        else:
+            rows = self.conn.execute("SELECT * FROM jobs ORDER BY id")
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job['settings'] = json.loads(job['settings'])
+            if job['failed_chapters']:
+                job['failed_chapters'] = json.loads(job['failed_chapters'])
+            jobs.append(job)
+        return jobs
+
+class QueueWorker:
+    """
+    Processus de travail : prend les tâches de la file une par une, analyse et
+    convertit les livres, plusieurs à la fois, sous un contrôleur de débit
+    adaptatif partagé par tous les livres en cours (au plus max_requests requêtes).
+    """
+    def __init__(self, queue, max_requests=DEFAULT_REQUEST_CONCURRENCY,
+                 books_in_parallel=DEFAULT_BOOKS_IN_PARALLEL,
+                 chapters_in_parallel=DEFAULT_CHAPTER_CONCURRENCY,
+                 poll_interval=DEFAULT_POLL_INTERVAL, once=False, metrics_dir=None, metrics_prom=None):
+        self.queue = queue
+        self.max_requests = max(1, max_requests)
+        self.books_in_parallel = max(1, books_in_parallel)
+        self.chapters_in_parallel = max(1, chapters_in_parallel)
+        self.poll_interval = poll_interval
+        self.once = once  # S'arrêter dès que la file est vide
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.running_jobs = set()
+        self.backends = {}  # Moteurs de synthèse partagés par les tâches, par nom
+        self.rate_controller = None  # Contrôleur de débit commun à tous les livres en cours
+        # Résumé JSON des mesures de chaque tâche (job_<id>.json) et fichier Prometheus
+        # des mesures cumulées du processus, réécrit à la fin de chaque tâche
+        self.metrics_dir = metrics_dir
+        self.metrics_prom = metrics_prom
+        self.metrics = ConversionMetrics()
+
+    def get_backend(self, name):
+        if name not in self.backends:
+            self.backends[name] = get_backend(name)
+        return self.backends[name]
+
+    async def run(self):
+        requeued = self.queue.requeue_stale()
+        if requeued:
+            logging.warning(f"{requeued} tâche(s) interrompue(s) remise(s) en file")
+        self.rate_controller = AdaptiveRateController(
+            initial_limit=min(DEFAULT_INITIAL_LIMIT, self.max_requests), max_limit=self.max_requests)
+        self.metrics = ConversionMetrics()
+        book_slots = asyncio.Semaphore(self.books_in_parallel)
+        heartbeat = asyncio.ensure_future(self.send_heartbeats())
+        tasks = set()
+        emit('worker_started', worker=self.worker_id, max_requests=self.max_requests,
+             books_in_parallel=self.books_in_parallel)
+        try:
+            while True:
+                await book_slots.acquire()
+                job = self.queue.claim_next(self.worker_id)
+                if job is None:
+                    book_slots.release()
+                    if self.once:
+                        break
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                task = asyncio.ensure_future(self.process(job))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: book_slots.release())
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            heartbeat.cancel()
+            for task in tasks:
+                task.cancel()
+            # Les tâches interrompues retournent dans la file pour un autre passage
+            for job_id in list(self.running_jobs):
+                self.queue.requeue(job_id)
+            for backend in self.backends.values():
+                await backend.aclose()
+        emit('worker_stopped', worker=self.worker_id)
+
+    async def send_heartbeats(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            self.queue.heartbeat(self.running_jobs)
+
+    async def process(self, job):
+        job_id = job['id']
+        file_path = job['input_path']
+        settings = job['settings']
+        self.running_jobs.add(job_id)
+        emit('job_started', job=job_id, file=file_path, attempt=job['attempts'] + 1)
+        try:
+            # L'analyse est bloquante : elle s'exécute dans un thread
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            chapitres = await loop.run_in_executor(None, analyze_document, file_path)
+            chapitres = [chapitre for chapitre in chapitres if chapitre.content.strip()]
+            analysis_seconds = time.monotonic() - started
+            self.queue.record_analysis(job_id, len(chapitres), analysis_seconds)
+            emit('job_analyzed', job=job_id, chapters=len(chapitres), seconds=round(analysis_seconds, 3))
+            if not chapitres:
+                raise ValueError("Aucun chapitre détecté")
+
+            output_dir = os.path.join(job['output_dir'], sanitize_filename(get_filename_without_extension(file_path)))
+            os.makedirs(output_dir, exist_ok=True)
+            metrics = ConversionMetrics()
+            pipeline = ChapterPipeline(
+                output_dir, voice_index=settings.get('voice', 4), rate=settings.get('rate', 0),
+                volume=settings.get('volume', 0), chapter_concurrency=self.chapters_in_parallel,
+                max_attempts=settings.get('max_attempts', 3),
+                sentence_attempts=settings.get('sentence_attempts', DEFAULT_SENTENCE_ATTEMPTS), job_name=file_path,
+                stream=settings.get('stream', False), rate_controller=self.rate_controller,
+                backend=self.get_backend(settings.get('backend', 'edge')), metrics=metrics,
+                on_message=logging.info,
+                on_event=lambda event, index, details: emit(event, job=job_id, chapter=index, **details))
+            started = time.monotonic()
+            failed_attempts = await pipeline.run(chapitres)
+            synthesis_seconds = time.monotonic() - started
+            metrics.stop()
+            self.queue.finish(job_id, sorted(failed_attempts), synthesis_seconds)
+            self.record_metrics(job_id, file_path, metrics)
+            emit('job_finished', job=job_id, failed_chapters=sorted(failed_attempts),
+                 analysis_seconds=round(analysis_seconds, 3), synthesis_seconds=round(synthesis_seconds, 3),
+                 rate=self.rate_controller.state(), metrics=metrics.summary())
+        except asyncio.CancelledError:
+            # La tâche reste dans running_jobs pour être remise en file à l'arrêt
+            raise
+        except Exception as e:
+            logging.error(f"Échec de la tâche {job_id} ({file_path}) : {e}")
+            self.queue.fail(job_id, str(e))
+            emit('job_failed', job=job_id, error=str(e))
+        self.running_jobs.discard(job_id)
+
+    def record_metrics(self, job_id, file_path, metrics):
+        # Les livres étant convertis en parallèle, les débits cumulés se rapportent
+        # à la durée de vie du processus et non à la somme des durées des tâches
+        self.metrics.merge(metrics, add_elapsed=False)
+        try:
+            if self.metrics_dir:
+                metrics.write_json(os.path.join(self.metrics_dir, f"job_{job_id}.json"), job=job_id, file=file_path)
+            if self.metrics_prom:
+                self.metrics.write_prometheus(self.metrics_prom, labels={'worker': self.worker_id})
+        except OSError as e:
+            logging.warning(f"Impossible d'écrire les mesures de la tâche {job_id} : {e}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="File d'attente persistante de conversions de livres audio.")
+    parser.add_argument('--db', default=DEFAULT_QUEUE_PATH, help="Chemin de la base SQLite de la file")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Afficher les journaux détaillés sur la sortie d'erreur")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help="Ajouter des livres à la file")
+    enqueue.add_argument('inputs', nargs='+', help="Fichiers ePub/PDF ou motifs glob")
+    enqueue.add_argument('-o', '--output', required=True, help="Dossier de destination")
+    enqueue.add_argument('--voice', type=int, default=4, choices=sorted(SUPPORTED_VOICES))
+    enqueue.add_argument('--rate', type=int, default=0)
+    enqueue.add_argument('--volume', type=int, default=0)
+    enqueue.add_argument('--max-attempts', type=int, default=3)
+    enqueue.add_argument('--sentence-attempts', type=int, default=DEFAULT_SENTENCE_ATTEMPTS)
+    enqueue.add_argument('--stream', action='store_true')
+    enqueue.add_argument('--backend', default='edge', choices=sorted(BACKENDS))
+
+    status = commands.add_parser('status', help="Afficher l'état des tâches")
+    status.add_argument('--status', choices=[QUEUED, RUNNING, DONE, FAILED])
+
+    work = commands.add_parser('work', help="Traiter la file en continu")
+    work.add_argument('--max-requests', type=int, default=DEFAULT_REQUEST_CONCURRENCY,
+                      help="Nombre maximal de requêtes de synthèse simultanées, tous livres confondus")
+    work.add_argument('--books-in-parallel', type=int, default=DEFAULT_BOOKS_IN_PARALLEL)
+    work.add_argument('--chapters-in-parallel', type=int, default=DEFAULT_CHAPTER_CONCURRENCY)
+    work.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL)
+    work.add_argument('--once', action='store_true', help="S'arrêter lorsque la file est vide")
+    work.add_argument('--metrics-dir', metavar='DOSSIER',
+                      help="Écrire le résumé JSON des mesures de chaque tâche (job_<id>.json)")
+    work.add_argument('--metrics-prom', metavar='FICHIER',
+                      help="Écrire les mesures cumulées du processus au format texte Prometheus "
+                           "(ex. dossier textfile de node_exporter)")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    queue = ConversionQueue(args.db)
+    try:
+        if args.command == 'enqueue':
+            files = expand_inputs(args.inputs)
+            # Vérifiés dès l'ajout : un chemin erroné échouerait sinon dans le processus de travail
+            missing = [path for path in files if not os.path.isfile(path)]
+            if not files or missing:
+                emit('error', error="Aucun fichier ePub ou PDF trouvé" if not files else "Fichiers introuvables",
+                     files=missing)
+                return 2
+            for file_path in files:
+                job_id = queue.enqueue(file_path, args.output, voice=args.voice, rate=args.rate,
+                                       volume=args.volume, max_attempts=args.max_attempts,
+                                       sentence_attempts=args.sentence_attempts, stream=args.stream,
+                                       backend=args.backend)
+                emit('job_queued', job=job_id, file=file_path)
+        elif args.command == 'status':
+            for job in queue.list_jobs(args.status):
+                emit('job', **job)
+        elif args.command == 'work':
+            clean_stale_job_dirs()
+            worker = QueueWorker(queue, max_requests=args.max_requests, books_in_parallel=args.books_in_parallel,
+                                 chapters_in_parallel=args.chapters_in_parallel,
+                                 poll_interval=args.poll_interval, once=args.once,
+                                 metrics_dir=args.metrics_dir, metrics_prom=args.metrics_prom)
+            try:
+                asyncio.run(worker.run())
+            except KeyboardInterrupt:
+                return 130
+        return 0
+    finally:
+        queue.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
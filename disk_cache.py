@@ -0,0 +1,133 @@
+# disk_cache.py
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+class DiskCache:
+    """
+    Stockage disque borné en taille, une entrée par fichier (cache_dir/xx/<clé><suffix>).
+    Les entrées les moins récemment utilisées sont supprimées lorsque la taille totale
+    dépasse max_bytes ; l'ordre d'utilisation persiste entre les exécutions grâce à la
+    date de modification des fichiers. Base commune des caches audio et d'analyse.
+    """
+    suffix = ''
+    description = 'cache'  # Nom utilisé dans les messages
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # clé -> taille, du moins au plus récemment utilisé
+        self._total_bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}{self.suffix}")
+
+    def _tmp_path(self, key):
+        return f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _load_index(self):
+        found = []
+        for path in Path(self.cache_dir).glob(f'*/*{self.suffix}'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path.name[:len(path.name) - len(self.suffix)], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _lookup(self, key, read):
+        """
+        Applique read(chemin) à l'entrée et la marque comme récemment utilisée.
+        Retourne None si l'entrée est absente.
+        """
+        with self._lock:
+            if key in self._entries:
+                path = self._path(key)
+                try:
+                    result = read(path)
+                    os.utime(path)
+                except OSError:
+                    # Entrée supprimée par un autre processus
+                    self._total_bytes -= self._entries.pop(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+            self.misses += 1
+            return None
+
+    def _store(self, key, write):
+        """
+        Écrit l'entrée par write(chemin_temporaire) puis la publie par renommage.
+        Une erreur d'écriture est signalée sans être propagée.
+        """
+        path = self._path(key)
+        tmp_path = self._tmp_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write(tmp_path)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logging.warning(f"Impossible d'ajouter l'entrée {key} au {self.description} : {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._register(key, size)
+
+    def _register(self, key, size):
+        with self._lock:
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+            }
+
+    @classmethod
+    def shared(cls):
+        """
+        Retourne l'instance du processus pour ce type de cache, créée à la première utilisation.
+        """
+        with _shared_lock:
+            if cls not in _shared:
+                _shared[cls] = cls()
+            return _shared[cls]
+
+_shared = {}
+_shared_lock = threading.Lock()
@@ -1,16 +1,155 @@
 import os
 import zipfile
-import shutil
+import posixpath
 import re
-from bs4 import BeautifulSoup
+import hashlib
+import itertools
+from urllib.parse import unquote
+from lxml import etree, html as lxml_html
 from PyPDF2 import PdfReader
 from pdfminer.high_level import extract_pages
 from pdfminer.layout import LAParams, LTTextContainer, LTTextLine, LTChar
 import re
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
 import logging
-import tempfile
-from pathlib import Path
+from analysis_cache import get_default_analysis_cache, file_digest
+
+CONTAINER_PATH = 'META-INF/container.xml'
+NCX_MEDIA_TYPE = 'application/x-dtbncx+xml'
+
+# En dessous de ces seuils, l'analyse des documents XHTML reste en série
+PARALLEL_MIN_DOCUMENTS = 16
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024  # Taille décompressée totale des documents
+
+def _processor_version():
+    # Version du code d'extraction : toute modification de ce fichier invalide le cache
+    # d'analyse. Sans accès au source (exécutable figé), le cache n'est pas utilisé.
+    try:
+        with open(__file__, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()[:16]
+    except (OSError, NameError):
+        return None
+
+PROCESSOR_VERSION = _processor_version()
+
+# Nombre de pages d'un PDF extraites par chaque tâche des processus de travail
+PAGES_PER_SHARD = 25
+
+# Détection des chapitres PDF : une ligne est un titre si sa police atteint
+# TITLE_FONT_RATIO fois la plus grande taille du document, ou si elle suit CHAPTER_PATTERN
+TITLE_FONT_RATIO = 0.9
+CHAPTER_PATTERN = re.compile(r'^(Chapter|Chapitre|Part|Section|Titre)\s+\d+.*$', re.IGNORECASE)
+STREAMING_MIN_PAGES = 100  # À partir de ce nombre de pages, détection en flux
+SAMPLE_HEAD_PAGES = 5      # Pages échantillonnées pour le seuil : les premières...
+SAMPLE_PAGES = 20          # ... puis des pages réparties dans le document
+WARMUP_LINES = 2000        # Lignes observées avant de fixer un seuil sans échantillon
+
+# Parseurs lxml : pas d'accès réseau ni d'entités externes pour les documents de l'archive
+XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, recover=True)
+HTML_PARSER = lxml_html.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True, no_network=True)
+
+class AnalysisCancelled(Exception):
+    """
+    Analyse interrompue à la demande de l'appelant (should_stop).
+    """
+
+def checkpoint(on_progress, should_stop, done, total, unit):
+    """
+    Signale l'avancement de l'analyse (done éléments sur total, None si inconnu ; unit
+    vaut 'documents', 'pages' ou 'chapters') et l'interrompt si l'arrêt est demandé.
+    """
+    if should_stop is not None and should_stop():
+        raise AnalysisCancelled("Analyse annulée")
+    if on_progress is not None:
+        on_progress(done, total, unit)
+
+def iter_pool_results(fn, items, workers, window=None):
+    """
+    Exécute fn(*args) pour chaque (étiquette, args) de items dans un pool de processus
+    et génère (étiquette, future) dans l'ordre de soumission. Au plus window tâches
+    (2 par processus par défaut) sont en attente : items n'est consommé qu'au fur et
+    à mesure. Si le générateur est abandonné (annulation, erreur), les tâches en file
+    sont annulées sans attendre celles en cours ; l'utiliser avec contextlib.closing.
+    """
+    window = window or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for tag, args in items:
+                pending.append((tag, executor.submit(fn, *args)))
+                if len(pending) >= window:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+def resolve_href(base_path, href):
+    """
+    Résout un lien relatif (sans son ancre) par rapport au fichier base_path
+    de l'archive et retourne le chemin normalisé du membre visé.
+    """
+    path = unquote(href.split('#', 1)[0])
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_path), path))
+
+# Clé du texte complet dans le résultat de split_text_at_anchors (jamais un id : les ids vides sont ignorés)
+WHOLE_DOCUMENT = ''
+
+def split_fragment(href):
+    """
+    Sépare un lien en (chemin, ancre) ; l'ancre vaut None en son absence.
+    """
+    path, _, fragment = href.partition('#')
+    return path, unquote(fragment) or None
+
+def join_text(pieces):
+    text_content = '\n'.join(piece.strip() for piece in pieces if piece.strip())
+    return re.sub(r'(?<!\n)\n(?!\n)', ' ', text_content)  # Merge single newlines
+
+def split_text_at_anchors(data, anchors=()):
+    """
+    Extrait le texte d'un document XHTML fourni en bytes, découpé aux éléments
+    dont l'id (ou le name) figure dans anchors. Retourne {None: texte avant la
+    première ancre rencontrée, ancre: texte jusqu'à l'ancre suivante} ; une
+    ancre absente du document est associée à un texte vide. Si anchors contient
+    WHOLE_DOCUMENT, le texte complet est aussi retourné sous cette clé. Les
+    scripts, styles et commentaires sont ignorés.
+    """
+    segments = {None: []}
+    segments.update((anchor, []) for anchor in anchors)
+    whole = segments.get(WHOLE_DOCUMENT)
+    if not data.strip():
+        return {key: '' for key in segments}
+    root = lxml_html.document_fromstring(data, parser=HTML_PARSER)
+    etree.strip_elements(root, 'script', 'style', with_tail=False)
+    body = root.find('body')
+    source = body if body is not None else root
+
+    current = segments[None]
+    for event, element in etree.iterwalk(source, events=('start', 'end')):
+        if event == 'start':
+            if anchors:
+                anchor = element.get('id') or element.get('name')
+                if anchor and anchor in segments:
+                    current = segments[anchor]
+            if element.text:
+                current.append(element.text)
+                if whole is not None:
+                    whole.append(element.text)
+        elif element is not source and element.tail:
+            current.append(element.tail)
+            if whole is not None:
+                whole.append(element.tail)
+    return {key: join_text(pieces) for key, pieces in segments.items()}
+
+def extract_text_from_xhtml(data):
+    """
+    Extrait le texte d'un document XHTML fourni en bytes ; les fragments de texte sont séparés par des espaces.
+    """
+    return split_text_at_anchors(data)[None]
 
 class EpubProcessor:
     class Chapter:
@@ -24,80 +163,211 @@ class EpubProcessor:
             content = self.content if self.content else "Contenu non disponible"
             print(f"{title} : {content[:100]}")  # Affiche les 100 premiers caractères du contenu
 
-    def __init__(self):
+    def __init__(self, max_workers=1, on_progress=None, should_stop=None):
+        """
+        :param max_workers: Nombre de processus pour l'analyse des documents XHTML
+                            (1 : en série, None : un par cœur)
+        :param on_progress: Fonction appelée avec (documents analysés, total, 'documents'), voir checkpoint
+        :param should_stop: Fonction sans argument ; l'analyse lève AnalysisCancelled dès qu'elle retourne True
+        """
         self.chapters = []
+        self.max_workers = max_workers
+        self.on_progress = on_progress
+        self.should_stop = should_stop
 
-    def extract_metadata(self, epub_path):
+    def read_package(self, zip_ref):
+        """
+        Lit container.xml puis le fichier OPF de l'archive.
+        Retourne (chemin de l'OPF, manifeste {id: (chemin, type, propriétés)}, id du NCX de la spine).
+        """
+        names = set(zip_ref.namelist())
+        opf_path = None
+        if CONTAINER_PATH in names:
+            container = etree.fromstring(zip_ref.read(CONTAINER_PATH), XML_PARSER)
+            rootfile = container.find('.//{*}rootfile') if container is not None else None
+            if rootfile is not None and rootfile.get('full-path') in names:
+                opf_path = rootfile.get('full-path')
+        if opf_path is None:
+            opf_path = next((name for name in sorted(names) if name.endswith('.opf')), None)
+        if opf_path is None:
+            return None, {}, None
+
+        package = etree.fromstring(zip_ref.read(opf_path), XML_PARSER)
+        manifest = {}
+        for item in package.iterfind('.//{*}manifest/{*}item'):
+            if item.get('id') and item.get('href'):
+                manifest[item.get('id')] = (resolve_href(opf_path, item.get('href')),
+                                            item.get('media-type', ''), item.get('properties', '').split())
+        spine = package.find('.//{*}spine')
+        return opf_path, manifest, spine.get('toc') if spine is not None else None
+
+    def read_ncx(self, zip_ref, ncx_path):
         chapters = []
-        with zipfile.ZipFile(epub_path, 'r') as zip_ref:
-            for file in zip_ref.namelist():
-                if file.endswith('ncx'):
-                    with zip_ref.open(file, 'r') as ncx_file:
-                        soup = BeautifulSoup(ncx_file, 'xml')
-                        nav_points = soup.find_all('navPoint')
-                        for nav_point in nav_points:
-                            title = nav_point.find('text').text.strip()
-                            if not title.endswith('.'):
-                                title += '.'
-                            content_src = nav_point.find('content').get('src')
-                            chapters.append(self.Chapter(title, content_src))
+        ncx = etree.fromstring(zip_ref.read(ncx_path), XML_PARSER)
+        for nav_point in ncx.iterfind('.//{*}navPoint'):
+            text = nav_point.find('{*}navLabel/{*}text')
+            content = nav_point.find('{*}content')
+            title = ''.join(text.itertext()).strip() if text is not None else ''
+            chapters.append((title, content.get('src') if content is not None else None))
         return chapters
 
-    def extract_content_from_archive(self, epub_path):
-        # Créer un dossier temporaire unique dans le dossier temp du système
-        temp_dir = os.path.join(tempfile.gettempdir(), 'epub_temp_' + str(os.getpid()))
-        os.makedirs(temp_dir, exist_ok=True)
-        
+    def read_nav(self, zip_ref, nav_path):
+        chapters = []
+        root = lxml_html.document_fromstring(zip_ref.read(nav_path), parser=HTML_PARSER)
+        navs = root.iter('nav')
+        toc = next((nav for nav in navs if any(value == 'toc' for key, value in nav.items()
+                                               if key.endswith('type'))), None)
+        for link in (toc if toc is not None else root).iter('a'):
+            if link.get('href'):
+                chapters.append((' '.join(''.join(link.itertext()).split()), link.get('href')))
+        return chapters
+
+    def read_toc(self, zip_ref, manifest, toc_id):
+        """
+        Retourne la table des matières [(titre, lien)] et le chemin du fichier qui la contient :
+        NCX déclaré par la spine, sinon document de navigation ePub 3, sinon premier .ncx de l'archive.
+        """
+        ncx_path = manifest[toc_id][0] if toc_id in manifest else None
+        if ncx_path is None:
+            ncx_path = next((path for path, media_type, _ in manifest.values() if media_type == NCX_MEDIA_TYPE), None)
+        if ncx_path is None:
+            nav_path = next((path for path, _, properties in manifest.values() if 'nav' in properties), None)
+            if nav_path is not None:
+                return self.read_nav(zip_ref, nav_path), nav_path
+            ncx_path = next((name for name in zip_ref.namelist() if name.endswith('ncx')), None)
+        if ncx_path is None:
+            return [], None
+        return self.read_ncx(zip_ref, ncx_path), ncx_path
+
+    def extract_metadata(self, epub_path):
         with zipfile.ZipFile(epub_path, 'r') as zip_ref:
-            zip_ref.extractall(temp_dir)
-        return temp_dir
+            return self.read_chapters(zip_ref)[0]
 
-    def extract_text_from_file(self, file_path):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                soup = BeautifulSoup(content, 'html.parser')
-                text_content = soup.get_text(separator='\n', strip=True)
-                text_content = re.sub(r'(?<!\n)\n(?!\n)', ' ', text_content)  # Merge single newlines
-                return text_content
-        except Exception as e:
-            logging.error(f"Erreur lors de la lecture du fichier {file_path}: {e}")
-            return ''
+    def read_chapters(self, zip_ref):
+        """
+        Retourne les chapitres de la table des matières et le chemin du fichier qui la contient.
+        """
+        _, manifest, toc_id = self.read_package(zip_ref)
+        toc, toc_path = self.read_toc(zip_ref, manifest, toc_id)
+        chapters = []
+        for title, content_src in toc:
+            if not title.endswith('.'):
+                title += '.'
+            chapters.append(self.Chapter(title, content_src))
+        return chapters, toc_path
 
-    def analyze_epub(self, epub_path):
-        self.chapters = self.extract_metadata(epub_path)
-        temp_dir = self.extract_content_from_archive(epub_path)
-        text_by_file = {}
+    def build_href_index(self, zip_ref):
+        """
+        Index des membres de l'archive : chemin normalisé, chemin en minuscules
+        et nom de fichier (seulement s'il est unique) vers le nom du membre.
+        """
+        index, lowercase, by_name = {}, {}, {}
+        for name in zip_ref.namelist():
+            if name.endswith('/'):
+                continue
+            path = posixpath.normpath(name)
+            index[path] = name
+            lowercase.setdefault(path.lower(), name)
+            by_name.setdefault(posixpath.basename(path), []).append(name)
+        unique_names = {file_name: names[0] for file_name, names in by_name.items() if len(names) == 1}
+        return index, lowercase, unique_names
 
+    def resolve_member(self, href_index, path):
+        index, lowercase, unique_names = href_index
+        return index.get(path) or lowercase.get(path.lower()) or unique_names.get(posixpath.basename(path))
+
+    def parse_documents(self, zip_ref, jobs):
+        """
+        Génère (membre, segments) pour chaque (membre, ancres) de jobs, segments valant
+        None en cas d'erreur. Les gros livres sont analysés dans un pool de processus ;
+        les petits restent en série, le démarrage des processus coûtant plus qu'il ne rapporte.
+        """
+        total_bytes = sum(zip_ref.getinfo(member).file_size for member, _ in jobs)
+        if self.max_workers == 1 or len(jobs) < PARALLEL_MIN_DOCUMENTS or total_bytes < PARALLEL_MIN_BYTES:
+            for member, anchors in jobs:
+                try:
+                    yield member, split_text_at_anchors(zip_ref.read(member), anchors)
+                except etree.LxmlError as e:
+                    logging.error(f"Erreur lors de la lecture du fichier {member}: {e}")
+                    yield member, None
+            return
+
+        workers = self.max_workers or os.cpu_count() or 1
+        logging.info(f"Analyse de {len(jobs)} documents sur {workers} processus")
+        # Fenêtre bornée : un document n'est décompressé qu'au moment d'être soumis
+        tasks = ((member, (zip_ref.read(member), anchors)) for member, anchors in jobs)
+        with closing(iter_pool_results(split_text_at_anchors, tasks, workers)) as results:
+            for member, future in results:
+                yield self.collect_document(member, future)
+
+    def collect_document(self, member, future):
         try:
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    if file.endswith(('.html', '.htm', '.xhtml')):
-                        file_path = os.path.join(root, file)
-                        text_content = self.extract_text_from_file(file_path)
-                        text_by_file[file] = text_content.strip()
+            return member, future.result()
+        except Exception as e:
+            logging.error(f"Erreur lors de la lecture du fichier {member}: {e}")
+            return member, None
 
-            for chapter in self.chapters:
-                content_src = chapter.content_src
-                if content_src:
-                    file_name = os.path.basename(content_src.split('#')[0])
-                    file_candidates = [file for file in text_by_file if file_name in file]
+    @staticmethod
+    def anchors_to_split(chapters):
+        """
+        Ancres auxquelles découper un document partagé par plusieurs chapitres
+        (liste vide pour un document propre à un seul chapitre).
+        """
+        if len(chapters) < 2:
+            return []
+        anchors = [fragment for _, fragment in chapters if fragment]
+        if any(fragment is None for _, fragment in chapters[1:]):
+            anchors.append(WHOLE_DOCUMENT)
+        return anchors
 
-                    if file_candidates:
-                        chapter.content = text_by_file.get(file_candidates[0], '')
-                        if len(file_candidates) > 1:
-                            logging.warning(f"Plusieurs fichiers correspondent à content_src {content_src}: {file_candidates}")
-                    else:
-                        logging.warning(f"Aucun fichier ne correspond à content_src {content_src}")
-                        chapter.content = ''
+    def analyze_epub(self, epub_path):
+        with zipfile.ZipFile(epub_path, 'r') as zip_ref:
+            self.chapters, toc_path = self.read_chapters(zip_ref)
+            href_index = self.build_href_index(zip_ref)
 
-                    if not chapter.content.strip():
-                        logging.warning(f"Attention: le chapitre '{chapter.title}' est vide. Vérifiez le fichier source {content_src}.")
+            # Chapitres regroupés par membre de l'archive, dans l'ordre de la table des matières
+            chapters_by_member = OrderedDict()
+            for chapter in self.chapters:
+                chapter.content = ''
+                if not chapter.content_src:
+                    continue
+                path, fragment = split_fragment(chapter.content_src)
+                member = self.resolve_member(href_index, resolve_href(toc_path or '', path))
+                if member is None:
+                    logging.warning(f"Aucun fichier ne correspond à content_src {chapter.content_src}")
+                    continue
+                chapters_by_member.setdefault(member, []).append((chapter, fragment))
 
-                chapter.content = re.sub(r'\s+', ' ', chapter.content).strip()
+            # Seuls les documents référencés sont décompressés ; un document partagé par
+            # plusieurs chapitres est découpé aux ancres de leurs liens
+            jobs = [(member, self.anchors_to_split(chapters)) for member, chapters in chapters_by_member.items()]
+            checkpoint(self.on_progress, self.should_stop, 0, len(jobs), 'documents')
+            for done, (member, segments) in enumerate(self.parse_documents(zip_ref, jobs), start=1):
+                checkpoint(self.on_progress, self.should_stop, done, len(jobs), 'documents')
+                if segments is None:
+                    continue
+                chapters = chapters_by_member[member]
+                assigned = set()
+                for position, (chapter, fragment) in enumerate(chapters):
+                    if position > 0 and fragment is None:
+                        # Nouvelle entrée sans ancre vers un document déjà utilisé : elle reçoit le
+                        # document entier, comme avant le découpage aux ancres
+                        logging.info(f"Le chapitre '{chapter.title}' reprend le document entier {member}, "
+                                     f"déjà utilisé par un chapitre précédent")
+                        chapter.content = segments[WHOLE_DOCUMENT]
+                        continue
+                    parts = []
+                    if position == 0:
+                        parts.append(segments[None])  # Le texte précédant la première ancre revient au premier chapitre
+                    if fragment in segments and fragment not in assigned and fragment is not None:
+                        parts.append(segments[fragment])
+                        assigned.add(fragment)
+                    chapter.content = ' '.join(part for part in parts if part)
 
-        finally:
-            shutil.rmtree(temp_dir)
+        for chapter in self.chapters:
+            if chapter.content_src and not chapter.content.strip():
+                logging.warning(f"Attention: le chapitre '{chapter.title}' est vide. Vérifiez le fichier source {chapter.content_src}.")
+            chapter.content = re.sub(r'\s+', ' ', chapter.content).strip()
 
         return self.chapters
 
@@ -131,48 +401,133 @@ def clean_and_format_text(text):
     
     return formatted_text.strip()
 
+def extract_lines_from_layouts(page_layouts):
+    """
+    Génère (texte, taille de police maximale) pour chaque ligne des pages mises en page par pdfminer.
+    """
+    for page_layout in page_layouts:
+        for element in page_layout:
+            if isinstance(element, LTTextContainer):
+                for text_line in element:
+                    if isinstance(text_line, LTTextLine):
+                        line_text = text_line.get_text().strip()
+                        font_sizes = [char.size for char in text_line if isinstance(char, LTChar)]
+                        if font_sizes:
+                            max_font_size = max(font_sizes)
+                            yield line_text, max_font_size
+
+def extract_page_range(pdf_path, first_page, last_page):
+    """
+    Extrait les lignes et tailles de police des pages [first_page, last_page[ (numérotées à partir de 0).
+    Fonction de module pour pouvoir être exécutée dans un processus de travail.
+    """
+    page_layouts = extract_pages(pdf_path, page_numbers=range(first_page, last_page), laparams=LAParams())
+    return list(extract_lines_from_layouts(page_layouts))
+
 class PdfProcessor:
-    def __init__(self):
-        pass
-
-    def extract_text_and_fonts_from_pdf(self, pdf_path):
-        laparams = LAParams()
-        text_content = []
-
-        # Extract text and font information from each page
-        for page_layout in extract_pages(pdf_path, laparams=laparams):
-            for element in page_layout:
-                if isinstance(element, LTTextContainer):
-                    for text_line in element:
-                        if isinstance(text_line, LTTextLine):
-                            line_text = text_line.get_text().strip()
-                            font_sizes = [char.size for char in text_line if isinstance(char, LTChar)]
-                            if font_sizes:
-                                max_font_size = max(font_sizes)
-                                text_content.append((line_text, max_font_size))
-
-        return text_content
+    def __init__(self, max_workers=1, pages_per_shard=PAGES_PER_SHARD, on_progress=None, should_stop=None):
+        """
+        :param max_workers: Nombre de processus d'extraction (1 : en série, None : un par cœur)
+        :param pages_per_shard: Nombre de pages extraites par chaque tâche d'un processus
+        :param on_progress: Fonction appelée avec (pages extraites, total, 'pages') et (chapitres trouvés, None, 'chapters'), voir checkpoint
+        :param should_stop: Fonction sans argument ; l'analyse lève AnalysisCancelled dès qu'elle retourne True
+        """
+        self.max_workers = max_workers
+        self.pages_per_shard = pages_per_shard
+        self.on_progress = on_progress
+        self.should_stop = should_stop
 
-    def detect_chapters(self, text_content):
-        chapters = []
-        chapter_pattern = re.compile(r'^(Chapter|Chapitre|Part|Section|Titre)\s+\d+.*$', re.IGNORECASE)
-        
-        current_chapter = None
-        chapter_content = []
+    def count_pages(self, pdf_path):
+        try:
+            return len(PdfReader(pdf_path).pages)
+        except Exception as e:
+            logging.warning(f"Impossible de compter les pages de {pdf_path} ({e}), extraction en série")
+            return None
+
+    def iter_text_and_fonts(self, pdf_path, page_count=None):
+        """
+        Génère (texte, taille de police) pour chaque ligne du PDF, dans l'ordre des pages.
+        Les longs documents sont découpés en tranches de pages extraites en parallèle ;
+        les lignes d'une tranche sont produites dès que celle-ci et les précédentes sont terminées.
+        """
+        total_pages = page_count  # Pour l'avancement uniquement
+        if self.max_workers == 1:
+            page_count = None
+        elif page_count is None:
+            page_count = total_pages = self.count_pages(pdf_path)
+        if not page_count or page_count < 2 * self.pages_per_shard:
+            page_layouts = self.track_pages(extract_pages(pdf_path, laparams=LAParams()), total_pages)
+            yield from extract_lines_from_layouts(page_layouts)
+            return
+
+        workers = self.max_workers or os.cpu_count() or 1
+        logging.info(f"Extraction de {page_count} pages sur {workers} processus")
+        # Fenêtre bornée de tranches soumises, fusionnées dans l'ordre des pages
+        def shards():
+            for first_page in range(0, page_count, self.pages_per_shard):
+                last_page = min(first_page + self.pages_per_shard, page_count)
+                yield last_page, (pdf_path, first_page, last_page)
+        with closing(iter_pool_results(extract_page_range, shards(), workers)) as results:
+            for last_page, future in results:
+                yield from self.collect_shard(last_page, future, page_count)
 
+    def collect_shard(self, last_page, future, page_count):
+        lines = future.result()
+        checkpoint(self.on_progress, self.should_stop, last_page, page_count, 'pages')
+        return lines
+
+    def track_pages(self, page_layouts, page_count=None):
+        """
+        Transmet les pages mises en page par pdfminer en signalant l'avancement après chacune.
+        """
+        for done, page_layout in enumerate(page_layouts, start=1):
+            yield page_layout
+            checkpoint(self.on_progress, self.should_stop, done, page_count, 'pages')
+
+    def extract_text_and_fonts_from_pdf(self, pdf_path, page_count=None):
+        return list(self.iter_text_and_fonts(pdf_path, page_count))
+
+    def title_threshold(self, text_content):
         # Define a threshold for font size to consider it as a chapter title
         if text_content:
-            title_font_size_threshold = max(font_size for _, font_size in text_content) * 0.9
-        else:
-            title_font_size_threshold = 0
+            return max(font_size for _, font_size in text_content) * TITLE_FONT_RATIO
+        return 0
 
-        for line, font_size in text_content:
-            if chapter_pattern.match(line) or font_size >= title_font_size_threshold:
+    def sample_title_threshold(self, pdf_path, page_count):
+        """
+        Estime le seuil des titres sur un échantillon de pages (les premières puis
+        des pages réparties dans tout le document), sans extraire tout le PDF.
+        """
+        step = max(page_count // SAMPLE_PAGES, 1)
+        pages = set(range(min(SAMPLE_HEAD_PAGES, page_count))) | set(range(0, page_count, step))
+        sample = extract_lines_from_layouts(extract_pages(pdf_path, page_numbers=pages, laparams=LAParams()))
+        return max((font_size for _, font_size in sample), default=0) * TITLE_FONT_RATIO or None
+
+    def iter_chapters(self, lines, threshold=None):
+        """
+        Génère les chapitres ({'title', 'content'}) à partir d'un itérable de
+        (ligne, taille de police), en ne gardant en mémoire que le chapitre en cours.
+
+        :param threshold: Taille de police minimale d'un titre. À défaut, elle est calculée
+                          sur les WARMUP_LINES premières lignes. Dans tous les cas, elle est
+                          relevée dès qu'une police plus grande apparaît.
+        """
+        lines = iter(lines)
+        if threshold is None:
+            warmup = list(itertools.islice(lines, WARMUP_LINES))
+            threshold = self.title_threshold(warmup)
+            lines = itertools.chain(warmup, lines)
+
+        current_chapter = None
+        chapter_content = []
+        for line, font_size in lines:
+            threshold = max(threshold, font_size * TITLE_FONT_RATIO)
+            if CHAPTER_PATTERN.match(line) or font_size >= threshold:
                 if current_chapter:
                     chapter_text = '\n'.join(chapter_content)
                     # Appliquer le nettoyage et la mise en forme ici
                     chapter_text = clean_and_format_text(chapter_text)
-                    chapters.append({'title': current_chapter, 'content': chapter_text})
+                    yield {'title': current_chapter, 'content': chapter_text}
                     chapter_content = []
                 current_chapter = line
             else:
@@ -184,30 +539,82 @@ class PdfProcessor:
             chapter_text = '\n'.join(chapter_content)
             # Appliquer le nettoyage et la mise en forme ici
             chapter_text = clean_and_format_text(chapter_text)
-            chapters.append({'title': current_chapter, 'content': chapter_text})
+            yield {'title': current_chapter, 'content': chapter_text}
 
+    def detect_chapters(self, text_content):
+        chapters = list(self.iter_chapters(text_content, self.title_threshold(text_content)))
         if not chapters:
-            print("Aucun chapitre détecté. Vérifiez l'expression régulière ou la structure du texte.")
-        
+            logging.warning("Aucun chapitre détecté. Vérifiez l'expression régulière ou la structure du texte.")
         return chapters
 
-    def analyze_pdf(self, pdf_path):
-        text_content = self.extract_text_and_fonts_from_pdf(pdf_path)
-        return self.detect_chapters(text_content)
+    def iter_pdf_chapters(self, pdf_path, line_sink=None):
+        """
+        Génère les chapitres du PDF. Les longs documents sont traités en flux : le seuil
+        des titres vient d'un échantillon de pages, et chaque chapitre est produit dès
+        que le titre suivant est extrait. Les autres utilisent le maximum exact du document.
 
-def clean_tmp():
-    # Nettoyer tous les dossiers temporaires créés par l'application
-    temp_base = tempfile.gettempdir()
-    patterns = ['epub_temp_*', 'audiobook_temp*']
-    
-    for pattern in patterns:
-        for temp_dir in Path(temp_base).glob(pattern):
-            try:
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-                    logging.info(f"Dossier temporaire supprimé : {temp_dir}")
-            except Exception as e:
-                logging.error(f"Erreur lors de la suppression du dossier temporaire {temp_dir}: {e}")
-
-# Assurez-vous que clean_tmp est exportée si vous utilisez __all__
-__all__ = ['EpubProcessor', 'PdfProcessor', 'clean_tmp']
+        :param line_sink: Fonction appelée avec (texte, taille de police) pour chaque ligne extraite
+        """
+        page_count = self.count_pages(pdf_path)
+        if page_count and page_count >= STREAMING_MIN_PAGES:
+            threshold = self.sample_title_threshold(pdf_path, page_count)
+            lines = self.iter_text_and_fonts(pdf_path, page_count)
+            if line_sink:
+                lines = ((line_sink(line, font_size), (line, font_size))[1] for line, font_size in lines)
+            chapters = self.iter_chapters(lines, threshold)
+        else:
+            text_content = self.extract_text_and_fonts_from_pdf(pdf_path, page_count)
+            if line_sink:
+                for line, font_size in text_content:
+                    line_sink(line, font_size)
+            chapters = self.iter_chapters(text_content, self.title_threshold(text_content))
+        for found, chapter in enumerate(chapters, start=1):
+            checkpoint(self.on_progress, self.should_stop, found, None, 'chapters')
+            yield chapter
+
+    def analyze_pdf(self, pdf_path, line_sink=None):
+        chapters = list(self.iter_pdf_chapters(pdf_path, line_sink))
+        if not chapters:
+            logging.warning("Aucun chapitre détecté. Vérifiez l'expression régulière ou la structure du texte.")
+        return chapters
+
+def analyze_document(file_path, max_workers=1, cache=None, use_cache=True, on_progress=None, should_stop=None):
+    """
+    Analyse un fichier ePub ou PDF et retourne ses chapitres sous forme
+    d'objets EpubProcessor.Chapter (attributs title et content).
+
+    :param max_workers: Nombre de processus d'analyse (1 : en série, None : un par cœur)
+    :param cache: Cache d'analyse (AnalysisCache) ; le cache par défaut si None
+    :param use_cache: Réutiliser et enregistrer les résultats d'analyse sur disque
+    :param on_progress: Fonction appelée avec (fait, total, unité) au fil de l'analyse, voir checkpoint
+    :param should_stop: Fonction sans argument ; l'analyse lève AnalysisCancelled dès qu'elle retourne True
+    """
+    if not file_path.lower().endswith(('.epub', '.pdf')):
+        raise ValueError(f"Type de fichier non pris en charge : {file_path}")
+    options = {'on_progress': on_progress, 'should_stop': should_stop}
+    if not use_cache or PROCESSOR_VERSION is None:
+        return _analyze_document(file_path, max_workers, **options)
+
+    if cache is None:
+        cache = get_default_analysis_cache()
+    key = cache.make_key(file_digest(file_path), PROCESSOR_VERSION)
+    cached = cache.get_chapters(key)
+    if cached is not None:
+        logging.info(f"Analyse de {file_path} lue depuis le cache ({len(cached)} chapitres)")
+        return [EpubProcessor.Chapter(chapter['title'], chapter['content_src'], chapter['content'])
+                for chapter in cached]
+
+    with cache.writer(key) as entry:
+        chapters = _analyze_document(file_path, max_workers, entry.write_line, **options)
+        for chapter in chapters:
+            entry.write_chapter(chapter.title, chapter.content, chapter.content_src)
+    return chapters
+
+def _analyze_document(file_path, max_workers, line_sink=None, on_progress=None, should_stop=None):
+    options = {'on_progress': on_progress, 'should_stop': should_stop}
+    if file_path.lower().endswith('.epub'):
+        return EpubProcessor(max_workers=max_workers, **options).analyze_epub(file_path)
+    chapters = PdfProcessor(max_workers=max_workers, **options).analyze_pdf(file_path, line_sink)
+    return [EpubProcessor.Chapter(chapter['title'], None, chapter['content']) for chapter in chapters]
+
+__all__ = ['EpubProcessor', 'PdfProcessor', 'analyze_document', 'AnalysisCancelled']
@@ -4,20 +4,34 @@ import tkinter as tk
 from tkinter import filedialog, ttk, scrolledtext, messagebox
 import threading
 import asyncio
+import queue
 import os
 import sys 
 import subprocess
 from pathlib import Path
 from PIL import Image, ImageTk
 import logging
-from epub_processor import EpubProcessor, PdfProcessor, clean_tmp
+from epub_processor import analyze_document, AnalysisCancelled
 from text_to_speech import text_to_speech, SUPPORTED_VOICES
+from conversion_pipeline import ChapterPipeline
 import pygame
 from utils import get_filename_without_extension, sanitize_filename, convert_epub_to_pdf
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Les messages des conversions sont affichés par lots, à intervalle régulier,
+# et seules les dernières lignes sont conservées dans le journal affiché
+UI_REFRESH_MS = 100
+MAX_LOG_LINES = 2000
+
+# Libellés de l'avancement de l'analyse, par unité (voir epub_processor.checkpoint)
+ANALYSIS_PROGRESS_LABELS = {
+    'documents': "documents analysés",
+    'pages': "pages extraites",
+    'chapters': "chapitres trouvés",
+}
+
 class EpubToAudioGUI:
     def __init__(self, master):
         self.master = master
@@ -31,16 +45,33 @@ class EpubToAudioGUI:
         self.output_path = tk.StringVar()
         self.voice_index = tk.StringVar(value="4 - fr-FR-RemyMultilingualNeural")
         self.chapitres = []
-        self.stop_requested = False
+        self.stop_event = None  # Demande d'arrêt de la conversion en cours (une par conversion)
+        self.pipeline = None  # Conversion en cours, pour pouvoir l'annuler
+        self.conversion_thread = None
         self.grid_row = 0
         self.failed_chapters = []  # Pour stocker les chapitres qui ont échoué
 
+        # Messages et progression publiés par les threads de travail, appliqués
+        # à l'interface par process_ui_updates dans le thread principal
+        self.pending_messages = queue.Queue()
+        self.pending_progress = None  # Seule la dernière valeur publiée compte
+        self.pending_status = None  # (texte,) : un nouveau tuple à chaque publication
+        self.shown_status = None
+        self.pending_calls = queue.Queue()  # Fonctions à exécuter dans le thread principal
+        self.log_line_count = 0
+
+        # Tâche de fond (analyse, conversion en PDF) et demande d'annulation
+        self.background_task = None
+        self.task_cancel = threading.Event()
+
         # Création des widgets
         self.create_widgets()
 
         # Configuration de la mise en page
         self.configure_layout()
 
+        self.master.after(UI_REFRESH_MS, self.process_ui_updates)
+
     def load_icon(self):
         icon_path = "ico.ico"
         if os.path.exists(icon_path):
@@ -121,7 +152,13 @@ class EpubToAudioGUI:
         self.pdf_conversion_button.pack(side=tk.LEFT, padx=(0, 10))  # Ajout d'un padding à droite
 
         # Bouton "Analyze Document"
-        ttk.Button(button_frame, text="Analyser le Document", command=self.analyze_epub_button_clicked).pack(side=tk.LEFT)
+        self.analyze_button = ttk.Button(button_frame, text="Analyser le Document", command=self.analyze_epub_button_clicked)
+        self.analyze_button.pack(side=tk.LEFT)
+
+        # Bouton d'annulation de l'analyse ou de la conversion en PDF en cours
+        self.cancel_task_button = ttk.Button(button_frame, text="Annuler", command=self.cancel_background_task,
+                                             state=tk.DISABLED)
+        self.cancel_task_button.pack(side=tk.LEFT, padx=(10, 0))
 
         self.grid_row += 1
 
@@ -184,24 +221,82 @@ class EpubToAudioGUI:
             self.status_label.config(text="Please select a file.")
             return
 
-        if file_path.lower().endswith('.epub'):
-            processor = EpubProcessor()
-            self.chapitres = processor.analyze_epub(file_path)
-        elif file_path.lower().endswith('.pdf'):
-            processor = PdfProcessor()
-            self.chapitres = processor.analyze_pdf(file_path)
-        else:
+        if not file_path.lower().endswith(('.epub', '.pdf')):
             self.status_label.config(text="Unsupported file type. Please select an EPUB or PDF file.")
             return
 
+        self.status_label.config(text="Analyse du document en cours...")
+        self.update_progress(0)
+        self.run_in_background(
+            lambda: analyze_document(file_path, max_workers=None, on_progress=self.report_analysis_progress,
+                                     should_stop=self.task_cancel.is_set),
+            self.analysis_finished)
+
+    def report_analysis_progress(self, done, total, unit):
+        # Appelée depuis le thread d'analyse
+        label = ANALYSIS_PROGRESS_LABELS.get(unit, unit)
+        if total:
+            self.update_status(f"Analyse : {done}/{total} {label}")
+            self.update_progress(done / total * 100)
+        else:
+            self.update_status(f"Analyse : {done} {label}")
+
+    def analysis_finished(self, chapitres, error):
+        if isinstance(error, AnalysisCancelled):
+            self.status_label.config(text="Analyse annulée.")
+            return
+        if error is not None:
+            logging.error(f"Erreur lors de l'analyse du document : {error}")
+            self.status_label.config(text=f"Erreur lors de l'analyse : {error}")
+            return
+
         # Filtrer les chapitres vides
-        self.chapitres = [chapitre for chapitre in self.chapitres if chapitre.content.strip()]
+        self.chapitres = [chapitre for chapitre in chapitres if chapitre.content.strip()]
 
         logging.info(f"Contenu extrait : {self.chapitres}")
         if not self.chapitres:
             logging.warning("Aucun chapitre détecté.")
+        self.update_progress(100)
+        self.status_label.config(text=f"Analyse terminée : {len(self.chapitres)} chapitres.")
         self.display_chapter_details()
 
+    def run_in_background(self, work, on_done):
+        """
+        Exécute work() dans un thread puis on_done(résultat, erreur) dans le thread principal.
+        Une seule tâche de fond à la fois ; le bouton Annuler positionne self.task_cancel.
+        """
+        if self.background_task is not None:
+            self.status_label.config(text="Une tâche est déjà en cours.")
+            return
+        self.task_cancel.clear()
+        self.analyze_button.config(state=tk.DISABLED)
+        self.pdf_conversion_button.config(state=tk.DISABLED)
+        self.cancel_task_button.config(state=tk.NORMAL)
+
+        def run():
+            result, error = None, None
+            try:
+                result = work()
+            except Exception as e:
+                error = e
+            self.call_in_ui(self.background_task_finished, on_done, result, error)
+
+        self.background_task = threading.Thread(target=run, daemon=True)
+        self.background_task.start()
+
+    def background_task_finished(self, on_done, result, error):
+        self.background_task = None
+        self.analyze_button.config(state=tk.NORMAL)
+        self.pdf_conversion_button.config(state=tk.NORMAL)
+        self.cancel_task_button.config(state=tk.DISABLED)
+        on_done(result, error)
+
+    def cancel_background_task(self):
+        if self.background_task is not None:
+            self.task_cancel.set()
+            self.cancel_task_button.config(state=tk.DISABLED)
+            self.status_label.config(text="Annulation en cours...")
+
     def display_chapter_details(self):
         self.chapter_listbox.delete(0, tk.END)
         total_words = 0
@@ -220,6 +315,13 @@ class EpubToAudioGUI:
         logging.info(f"Affichage des détails des chapitres : {len(self.chapitres)} chapitres, {total_words} mots au total")
 
     def start_conversion(self):
+        if self.background_task is not None:
+            self.status_label.config(text="Veuillez attendre la fin de l'analyse ou de la conversion en PDF.")
+            return
+        if self.conversion_thread is not None and self.conversion_thread.is_alive():
+            # Y compris après Stop : la conversion précédente n'est pas encore terminée
+            self.status_label.config(text="Veuillez attendre la fin de la conversion en cours.")
+            return
         if not self.chapitres:
             self.status_label.config(text="Veuillez analyser un document avant de convertir.")
             return
@@ -264,132 +366,147 @@ class EpubToAudioGUI:
         
         if not self.stop_button.cget("state") == tk.NORMAL:
             self.stop_button.config(state=tk.NORMAL)
+        # Chaque conversion a sa propre demande d'arrêt : celle d'une conversion précédente
+        # ne peut ni être effacée ni toucher la nouvelle
+        self.stop_event = threading.Event()
 
-        self.conversion_thread = threading.Thread(target=self.run_conversion, args=(output_dir, voice_index))
+        self.conversion_thread = threading.Thread(target=self.run_conversion,
+                                                  args=(output_dir, voice_index, self.stop_event))
         self.conversion_thread.start()
 
-    def run_conversion(self, output_dir, voice_index):
-        self.master.after(0, self.update_conversion_details, "Début de la conversion...")
-        self.master.after(0, self.update_progress, 0)
+    def run_conversion(self, output_dir, voice_index, stop_event):
+        self.update_conversion_details("Début de la conversion...")
+        self.update_progress(0)
+        pipeline = ChapterPipeline(
+            output_dir, voice_index=voice_index, job_name=self.epub_path.get(),
+            on_message=self.update_conversion_details,
+            on_progress=self.update_progress,
+            should_stop=stop_event.is_set)
+        self.pipeline = pipeline
+        if stop_event.is_set():
+            pipeline.cancel()
         try:
-            asyncio.run(self.convert_chapters(output_dir, voice_index))
+            asyncio.run(self.convert_chapters(pipeline))
         except Exception as e:
             logging.error(f"Une erreur s'est produite pendant la conversion : {str(e)}")
-            self.master.after(0, lambda: self.status_label.config(text="Erreur pendant la conversion. Voir les détails."))
-            self.master.after(0, self.update_conversion_details, f"Erreur : {str(e)}")
+            self.update_status("Erreur pendant la conversion. Voir les détails.")
+            self.update_conversion_details(f"Erreur : {str(e)}")
         finally:
-            epub_file = self.epub_path.get()
-            if epub_file:
-                clean_tmp()  # Appel sans argument
-            self.master.after(0, self.conversion_complete)
-            self.master.after(0, lambda: self.stop_button.config(state=tk.DISABLED))
-
-    async def convert_chapters(self, output_dir, voice_index):
-        total_chapters = len(self.chapitres)
-        padding_length = len(str(total_chapters))
-        pending_chapters = [(i, chapitre) for i, chapitre in enumerate(self.chapitres, start=1)]
-        failed_attempts = {}  # Pour suivre le nombre d'échecs par chapitre
-        
-        while pending_chapters and not self.stop_requested:
-            current_batch = pending_chapters[:]
-            pending_chapters = []
-            
-            for i, chapitre in current_batch:
-                if self.stop_requested:
-                    break
-                    
-                if not chapitre.content.strip():
-                    self.master.after(0, self.update_conversion_details, f"Chapitre {i} vide, ignoré.")
-                    continue
-                
-                chapter_number = str(i).zfill(padding_length)
-                chapter_name = f"chapitre_{chapter_number}.mp3"
-                output_file = os.path.join(output_dir, chapter_name)
-                
-                # Obtenir le nombre d'échecs précédents pour ce chapitre
-                attempts = failed_attempts.get(i, 0)
-                
-                # Calculer le temps de pause en fonction du nombre d'échecs
-                pause_time = min(30 * (2 ** attempts), 300)  # Max 5 minutes de pause
-                
-                if attempts > 0:
-                    self.master.after(0, self.update_conversion_details,
-                                    f"Tentative #{attempts+1} pour le chapitre {i} après une pause de {pause_time} secondes...")
-                    await asyncio.sleep(pause_time)
-                
-                try:
-                    self.master.after(0, self.update_conversion_details,
-                                    f"Conversion du chapitre {i}/{total_chapters}...")
-                    
-                    await text_to_speech(chapitre.content, voice_index=voice_index,
-                                       output_file=output_file, chapter_title=chapitre.title)
-                    
-                    progress = (len([c for c in range(1, total_chapters + 1) if c not in failed_attempts]) / total_chapters) * 100
-                    self.master.after(0, self.update_progress, progress)
-                    self.master.after(0, self.update_conversion_details,
-                                    f"Chapitre {i}/{total_chapters} converti avec succès en tant que {chapter_name}")
-                    
-                    # Retirer ce chapitre des échecs s'il était présent
-                    failed_attempts.pop(i, None)
-                    
-                    # Petite pause entre les chapitres réussis
-                    await asyncio.sleep(1)
-                    
-                except Exception as e:
-                    error_message = f"Échec de la conversion du chapitre {i} : {str(e)}"
-                    logging.error(error_message)
-                    self.master.after(0, self.update_conversion_details, error_message)
-                    
-                    # Incrémenter le compteur d'échecs pour ce chapitre
-                    failed_attempts[i] = attempts + 1
-                    
-                    # Remettre le chapitre dans la file d'attente
-                    pending_chapters.append((i, chapitre))
-                    
-                    self.master.after(0, self.update_conversion_details,
-                                    f"Le chapitre {i} sera réessayé plus tard (échec #{attempts+1})")
-            
-            # Si des chapitres sont toujours en échec, faire une pause plus longue
-            if pending_chapters:
-                longest_wait = max(failed_attempts.values())
-                pause_time = min(30 * (2 ** longest_wait), 300)
-                self.master.after(0, self.update_conversion_details,
-                                f"Pause de {pause_time} secondes avant de réessayer {len(pending_chapters)} chapitres...")
-                await asyncio.sleep(pause_time)
+            # Les dossiers temporaires des chapitres terminés sont supprimés par text_to_speech ;
+            # ceux des chapitres interrompus ou en échec sont conservés pour la reprise
+            if self.pipeline is pipeline:
+                self.pipeline = None
+            self.call_in_ui(self.conversion_complete, stop_event)
+
+    async def convert_chapters(self, pipeline):
+        failed_attempts = await pipeline.run(self.chapitres)
         
         # Rapport final
-        if failed_attempts:
-            self.master.after(0, self.update_conversion_details,
-                             f"\nConversion terminée avec {len(failed_attempts)} chapitres toujours en échec :"
-                             f"\nChapitres problématiques : {', '.join(str(i) for i in failed_attempts.keys())}"
-                             f"\nNombre de tentatives : {failed_attempts}")
+        if pipeline.cancelled:
+            self.update_conversion_details("\nConversion arrêtée. Relancez-la pour reprendre là où elle s'est arrêtée.")
+        elif failed_attempts:
+            self.update_conversion_details(
+                f"\nConversion terminée avec {len(failed_attempts)} chapitres toujours en échec :"
+                f"\nChapitres problématiques : {', '.join(str(i) for i in sorted(failed_attempts))}"
+                f"\nNombre de tentatives : {failed_attempts}")
         else:
-            self.master.after(0, self.update_conversion_details,
-                             "\nTous les chapitres ont été convertis avec succès!")
+            self.update_conversion_details("\nTous les chapitres ont été convertis avec succès!")
 
     def stop_conversion(self):
-        self.stop_requested = True
+        if self.stop_event is None:
+            return
+        self.stop_event.set()
         self.status_label.config(text="Arrêt de la conversion...")
         self.stop_button.config(state=tk.DISABLED)
-        epub_file = self.epub_path.get()
-        if epub_file:
-            clean_tmp(epub_file)
-        self.status_label.config(text="Conversion arrêtée et fichiers temporaires nettoyés.")
-
-    def conversion_complete(self):
+        # Annule les synthèses en cours et ferme les connexions (sans effet si la conversion
+        # n'a pas encore démarré : stop_event est alors vérifié au démarrage)
+        pipeline = self.pipeline
+        if pipeline is not None:
+            pipeline.cancel()
+
+    def conversion_complete(self, stop_event):
+        if stop_event is not self.stop_event:
+            return  # Conversion remplacée entre-temps : l'interface appartient à la nouvelle
+        self.stop_button.config(state=tk.DISABLED)
+        if stop_event.is_set():
+            self.status_label.config(text="Conversion arrêtée. Les fichiers temporaires sont conservés pour la reprise.")
+            return
         self.status_label.config(text="Conversion complete!")
-        self.progress['value'] = 100
+        self.update_progress(100)
 
     def update_conversion_details(self, message):
-        self.conversion_details.config(state=tk.NORMAL)
-        self.conversion_details.insert(tk.END, message + "\n")
-        self.conversion_details.see(tk.END)
-        self.conversion_details.config(state=tk.DISABLED)
-        self.master.update()  # Force la mise à jour de l'interface immédiatement
+        """
+        Ajoute un message au journal affiché. Peut être appelée depuis n'importe quel thread.
+        """
+        self.pending_messages.put(message)
 
     def update_progress(self, value):
-        self.progress['value'] = value
-        self.master.update_idletasks()  # Force la mise à jour de l'interface
+        """
+        Met à jour la barre de progression au prochain rafraîchissement ; les valeurs
+        intermédiaires publiées entre deux rafraîchissements sont ignorées.
+        """
+        self.pending_progress = value
+
+    def update_status(self, text):
+        """
+        Met à jour le texte de statut au prochain rafraîchissement. Peut être appelée depuis n'importe quel thread.
+        """
+        self.pending_status = (text,)
+
+    def call_in_ui(self, func, *args):
+        """
+        Exécute func(*args) dans le thread principal au prochain rafraîchissement.
+        """
+        self.pending_calls.put((func, args))
+
+    def process_ui_updates(self):
+        """
+        Applique à l'interface, en une fois, les messages et la progression publiés
+        depuis le rafraîchissement précédent, puis se reprogramme.
+        """
+        messages = []
+        try:
+            while True:
+                messages.append(self.pending_messages.get_nowait())
+        except queue.Empty:
+            pass
+
+        if messages:
+            # Les messages au-delà de MAX_LOG_LINES seraient aussitôt retirés du journal
+            skipped = len(messages) - MAX_LOG_LINES
+            if skipped > 0:
+                messages = [f"... {skipped} messages non affichés ..."] + messages[skipped:]
+            text = "\n".join(messages) + "\n"
+            self.conversion_details.config(state=tk.NORMAL)
+            self.conversion_details.insert(tk.END, text)
+            self.log_line_count += text.count("\n")
+            excess = self.log_line_count - MAX_LOG_LINES
+            if excess > 0:
+                self.conversion_details.delete("1.0", f"{excess + 1}.0")
+                self.log_line_count -= excess
+            self.conversion_details.see(tk.END)
+            self.conversion_details.config(state=tk.DISABLED)
+
+        # Lecture sans remise à zéro : une valeur publiée pendant le rafraîchissement n'est pas perdue
+        progress = self.pending_progress
+        if progress is not None and progress != self.progress['value']:
+            self.progress['value'] = progress
+        status = self.pending_status
+        if status is not None and status is not self.shown_status:
+            self.status_label.config(text=status[0])
+            self.shown_status = status
+
+        try:
+            while True:
+                func, args = self.pending_calls.get_nowait()
+                try:
+                    func(*args)
+                except Exception as e:
+                    logging.error(f"Erreur lors de la mise à jour de l'interface : {e}")
+        except queue.Empty:
+            pass
+
+        self.master.after(UI_REFRESH_MS, self.process_ui_updates)
 
     def test_voice(self):
         selected_voice = self.selected_voice.get()
@@ -431,19 +548,33 @@ class EpubToAudioGUI:
             return
 
         self.status_label.config(text="Conversion en PDF en cours...")
-        self.master.update()
+        self.update_progress(0)
 
         output_dir = os.path.dirname(epub_path)
-        pdf_path = convert_epub_to_pdf(epub_path, output_dir)
+        self.run_in_background(
+            lambda: convert_epub_to_pdf(epub_path, output_dir, on_progress=self.report_pdf_progress,
+                                        should_stop=self.task_cancel.is_set),
+            self.pdf_conversion_finished)
+
+    def report_pdf_progress(self, percent, step):
+        # Appelée depuis le thread de conversion
+        self.update_status(f"Conversion en PDF : {percent}% {step}")
+        self.update_progress(percent)
 
+    def pdf_conversion_finished(self, pdf_path, error):
         if pdf_path:
+            self.update_progress(100)
             self.status_label.config(text="Conversion en PDF terminée.")
             messagebox.showinfo("Succès", f"Le fichier PDF a été créé : {pdf_path}")
             # Mise à jour du champ de sélection du fichier avec le chemin du PDF
             self.epub_path.set(pdf_path)
             self.epub_entry.delete(0, tk.END)
             self.epub_entry.insert(0, pdf_path)
+        elif self.task_cancel.is_set():
+            self.status_label.config(text="Conversion en PDF annulée.")
         else:
+            if error is not None:
+                logging.error(f"Erreur lors de la conversion en PDF : {error}")
             self.status_label.config(text="Échec de la conversion en PDF.")
             messagebox.showerror("Erreur", "La conversion en PDF a échoué. Veuillez vérifier les logs pour plus de détails.")
 
@@ -0,0 +1,104 @@
+# job_journal.py
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+
+JOB_DIR_PREFIX = 'audiobook_temp_'
+# Âge (depuis la dernière écriture) au-delà duquel le dossier d'une tâche abandonnée est supprimé
+STALE_JOB_DIR_AGE = 7 * 24 * 3600
+
+def make_job_key(*parts):
+    """
+    Calcule une clé déterministe à partir des paramètres d'une tâche
+    (livre, chapitre, texte, réglages), identique d'un processus à l'autre.
+    """
+    payload = json.dumps(parts, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def job_temp_dir(job_key):
+    """
+    Dossier temporaire associé à une tâche ; le même dossier est retrouvé
+    après un arrêt brutal, ce qui permet la reprise.
+    """
+    return os.path.join(tempfile.gettempdir(), f'{JOB_DIR_PREFIX}{job_key[:32]}')
+
+def clean_stale_job_dirs(max_age=STALE_JOB_DIR_AGE):
+    """
+    Supprime les dossiers temporaires des tâches abandonnées (conversion annulée ou
+    en échec jamais reprise) sans écriture depuis max_age secondes. Les dossiers plus
+    récents sont conservés pour la reprise. Retourne le nombre de dossiers supprimés.
+    """
+    limit = time.time() - max_age
+    removed = 0
+    for temp_dir in Path(tempfile.gettempdir()).glob(f'{JOB_DIR_PREFIX}*'):
+        try:
+            # Le journal reçoit une ligne par segment : sa date suit l'activité de la tâche
+            journal = temp_dir / JobJournal.FILE_NAME
+            last_write = max(temp_dir.stat().st_mtime, journal.stat().st_mtime if journal.exists() else 0)
+            if not temp_dir.is_dir() or last_write > limit:
+                continue
+            shutil.rmtree(temp_dir)
+            removed += 1
+            logging.info(f"Dossier temporaire abandonné supprimé : {temp_dir}")
+        except OSError as e:
+            logging.warning(f"Erreur lors de la suppression du dossier temporaire {temp_dir} : {e}")
+    return removed
+
+class JobJournal:
+    """
+    Journal de progression en ajout seul (une ligne JSON par segment terminé).
+    Chaque enregistrement coûte une écriture de quelques octets, au lieu de
+    réécrire tout l'état à chaque phrase ; une dernière ligne tronquée par un
+    arrêt brutal est simplement ignorée au rechargement.
+    """
+    FILE_NAME = 'journal.log'
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.FILE_NAME)
+        self._file = None
+
+    def load(self):
+        """
+        Relit le journal et retourne l'état le plus récent de chaque segment :
+        un dictionnaire index -> enregistrement.
+        """
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                    entries[entry['i']] = entry
+                except (ValueError, KeyError, TypeError):
+                    logging.warning(f"Ligne {line_number} du journal {self.path} illisible, ignorée")
+        return entries
+
+    def record(self, index, ok, **extra):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        entry = {'i': index, 'ok': ok}
+        entry.update(extra)
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        # flush suffit à survivre à l'arrêt du processus ; fsync est fait à la fermeture
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            try:
+                os.fsync(self._file.fileno())
+            finally:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
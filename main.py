@@ -3,8 +3,10 @@
 import sys
 import os
 import logging
+import multiprocessing
 import tkinter as tk
 from gui import EpubToAudioGUI
+from job_journal import clean_stale_job_dirs
 
 # Configuration du logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,6 +22,8 @@ def resource_path(relative_path):
 
 def main():
     try:
+        # Dossiers de reprise des conversions abandonnées depuis longtemps
+        clean_stale_job_dirs()
         root = tk.Tk()
         root.title("ePub to Audiobook Converter")
         root.minsize(500, 600)
@@ -35,4 +39,6 @@ def main():
         logging.error("An error occurred: %s", e)
 
 if __name__ == "__main__":
+    # Nécessaire aux processus d'analyse dans l'exécutable PyInstaller sous Windows
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
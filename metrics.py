@@ -0,0 +1,273 @@
+# metrics.py
+#
+# Mesures de la synthèse : latence des requêtes, débit (caractères et
+# secondes d'audio produites par seconde), nouvelles tentatives, refus du
+# service, cache, durée des fusions et des chapitres. Exportables en résumé
+# JSON et au format texte Prometheus (collecteur « textfile » de node_exporter).
+
+import os
+import json
+import time
+import bisect
+import threading
+
+from rate_controller import is_throttle_error
+
+# Débit du format audio produit par tous les moteurs (audio-24khz-48kbitrate-mono-mp3)
+AUDIO_BYTES_PER_SECOND = 48000 / 8
+METRIC_PREFIX = 'audiobook'
+
+# Bornes supérieures des histogrammes, en secondes
+REQUEST_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+MERGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+CHAPTER_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+class Histogram:
+    """
+    Histogramme cumulatif à bornes fixes, comme les histogrammes Prometheus.
+    """
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Dernière case : au-delà de la plus grande borne
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError("Histogrammes de bornes différentes")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        """
+        Estime le quantile q (0 à 1) par interpolation linéaire dans la case qui le contient.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def summary(self):
+        def rounded(value):
+            return round(value, 4) if value is not None else None
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'mean': rounded(self.sum / self.count if self.count else None),
+            'p50': rounded(self.quantile(0.5)),
+            'p95': rounded(self.quantile(0.95)),
+            'p99': rounded(self.quantile(0.99)),
+            'max': rounded(self.max),
+            'buckets': {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+    def prometheus_lines(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels(labels, le=format_value(bound))} {cumulative}")
+        lines.append(f"{name}_bucket{format_labels(labels, le='+Inf')} {self.count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {format_value(self.sum)}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.count}")
+        return lines
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def format_labels(labels, **extra):
+    items = dict(labels or {}, **extra)
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for value in items.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(items, escaped)) + '}'
+
+def write_atomic(path, text):
+    """
+    Écrit le fichier par renommage d'un fichier temporaire : node_exporter ne lit
+    jamais un fichier à moitié écrit.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+class ConversionMetrics:
+    """
+    Compteurs et histogrammes d'une conversion (un livre, ou le cumul de plusieurs
+    via merge). Les méthodes record_* / observe_* peuvent être appelées depuis
+    plusieurs threads.
+    """
+    COUNTERS = ('requests', 'request_errors', 'retries', 'throttles', 'cache_hits', 'cache_misses',
+                'characters_synthesized', 'characters_cached', 'audio_seconds_synthesized',
+                'audio_seconds_cached', 'chapters_done', 'chapters_failed')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.elapsed = None  # Durée figée par stop() ; sinon calculée à la demande
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.request_latency = Histogram(REQUEST_LATENCY_BUCKETS)
+        self.merge_duration = Histogram(MERGE_BUCKETS)
+        self.chapter_duration = Histogram(CHAPTER_BUCKETS)
+
+    def _add(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def observe_request(self, latency, characters, audio_bytes):
+        """
+        Requête de synthèse réussie : latence en secondes, texte envoyé et audio reçu.
+        """
+        with self._lock:
+            self.request_latency.observe(latency)
+        self._add(requests=1, characters_synthesized=characters,
+                  audio_seconds_synthesized=audio_bytes / AUDIO_BYTES_PER_SECOND)
+
+    def record_error(self, error):
+        self._add(requests=1, request_errors=1, throttles=1 if is_throttle_error(error) else 0)
+
+    def record_retry(self):
+        self._add(retries=1)
+
+    def record_cache(self, hit, characters=0, audio_bytes=0):
+        if hit:
+            self._add(cache_hits=1, characters_cached=characters,
+                      audio_seconds_cached=audio_bytes / AUDIO_BYTES_PER_SECOND)
+        else:
+            self._add(cache_misses=1)
+
+    def observe_merge(self, seconds):
+        with self._lock:
+            self.merge_duration.observe(seconds)
+
+    def observe_chapter(self, seconds, ok):
+        with self._lock:
+            self.chapter_duration.observe(seconds)
+        self._add(**{'chapters_done' if ok else 'chapters_failed': 1})
+
+    def start(self):
+        """
+        Remet à zéro l'horloge des débits (début de la synthèse, après l'analyse du livre).
+        """
+        self._started = time.monotonic()
+        self.elapsed = None
+
+    def stop(self):
+        """
+        Fige la durée de référence des débits (fin de la conversion).
+        """
+        self.elapsed = time.monotonic() - self._started
+
+    def elapsed_seconds(self):
+        return self.elapsed if self.elapsed is not None else time.monotonic() - self._started
+
+    def merge(self, other, add_elapsed=True):
+        """
+        Ajoute les mesures d'une autre conversion (cumul de plusieurs livres).
+
+        :param add_elapsed: Additionner les durées pour le calcul des débits (livres convertis
+                            l'un après l'autre) ; False pour garder sa propre horloge (livres
+                            convertis en parallèle par un même processus)
+        """
+        with self._lock:
+            for name in self.COUNTERS:
+                self.counters[name] += other.counters[name]
+            self.request_latency.merge(other.request_latency)
+            self.merge_duration.merge(other.merge_duration)
+            self.chapter_duration.merge(other.chapter_duration)
+            if add_elapsed:
+                self.elapsed = (self.elapsed or 0.0) + other.elapsed_seconds()
+
+    def summary(self):
+        """
+        Résumé JSON des mesures, avec les débits rapportés à la durée de la conversion.
+        """
+        with self._lock:
+            elapsed = self.elapsed_seconds()
+            counters = dict(self.counters)
+            result = {
+                'started_at': round(self.started_at, 3),
+                'elapsed_seconds': round(elapsed, 3),
+                'counters': {name: round(value, 3) if isinstance(value, float) else value
+                             for name, value in counters.items()},
+                'characters_per_second': round(counters['characters_synthesized'] / elapsed, 2) if elapsed else None,
+                'audio_seconds_per_second': round(counters['audio_seconds_synthesized'] / elapsed, 3) if elapsed else None,
+                'request_latency_seconds': self.request_latency.summary(),
+                'merge_seconds': self.merge_duration.summary(),
+                'chapter_seconds': self.chapter_duration.summary(),
+            }
+        return result
+
+    def to_prometheus(self, labels=None):
+        """
+        Mesures au format texte d'exposition Prometheus.
+
+        :param labels: Étiquettes ajoutées à chaque série (ex. {'worker': 'hôte:pid'})
+        """
+        prefix = METRIC_PREFIX
+        with self._lock:
+            elapsed = self.elapsed_seconds()
+            c = dict(self.counters)
+            lines = []
+
+            def metric(name, kind, help_text, samples):
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+                for extra, value in samples:
+                    lines.append(f"{prefix}_{name}{format_labels(labels, **extra)} {format_value(value)}")
+
+            metric('tts_requests_total', 'counter', "Requetes de synthese envoyees.", [({}, c['requests'])])
+            metric('tts_request_errors_total', 'counter', "Requetes de synthese en echec.", [({}, c['request_errors'])])
+            metric('tts_retries_total', 'counter', "Nouvelles tentatives de synthese.", [({}, c['retries'])])
+            metric('tts_throttles_total', 'counter', "Refus du service (limitation de debit).", [({}, c['throttles'])])
+            metric('cache_requests_total', 'counter', "Consultations du cache audio.",
+                   [({'result': 'hit'}, c['cache_hits']), ({'result': 'miss'}, c['cache_misses'])])
+            metric('characters_total', 'counter', "Caracteres convertis en audio.",
+                   [({'source': 'tts'}, c['characters_synthesized']), ({'source': 'cache'}, c['characters_cached'])])
+            metric('audio_seconds_total', 'counter', "Secondes d'audio produites.",
+                   [({'source': 'tts'}, c['audio_seconds_synthesized']),
+                    ({'source': 'cache'}, c['audio_seconds_cached'])])
+            metric('chapters_total', 'counter', "Chapitres traites.",
+                   [({'status': 'done'}, c['chapters_done']), ({'status': 'failed'}, c['chapters_failed'])])
+            metric('elapsed_seconds', 'gauge', "Duree de conversion mesuree.", [({}, elapsed)])
+            metric('characters_per_second', 'gauge', "Caracteres synthetises par seconde.",
+                   [({}, c['characters_synthesized'] / elapsed if elapsed else 0.0)])
+            metric('audio_seconds_per_second', 'gauge', "Secondes d'audio synthetisees par seconde.",
+                   [({}, c['audio_seconds_synthesized'] / elapsed if elapsed else 0.0)])
+
+            for name, help_text, histogram in (
+                    ('tts_request_duration_seconds', "Latence des requetes de synthese.", self.request_latency),
+                    ('merge_duration_seconds', "Duree des fusions de chapitres.", self.merge_duration),
+                    ('chapter_duration_seconds', "Duree de conversion des chapitres.", self.chapter_duration)):
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                lines.extend(histogram.prometheus_lines(f"{prefix}_{name}", labels))
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path, **extra):
+        write_atomic(path, json.dumps(dict(extra, **self.summary()), ensure_ascii=False, indent=2) + '\n')
+
+    def write_prometheus(self, path, labels=None):
+        write_atomic(path, self.to_prometheus(labels))
@@ -0,0 +1,347 @@
+# mp3_concat.py
+
+import os
+import mmap
+import struct
+import logging
+
+# Tables de la norme MPEG audio (en kbit/s), indexées par [version MPEG 1 ou 2][couche]
+BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# Fréquences d'échantillonnage par champ « version » de l'en-tête (3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5)
+SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+TOC_SIZE = 100
+XING_FLAGS = 0x0001 | 0x0002 | 0x0004  # nombre de trames, nombre d'octets, table des positions
+COPY_BUFFER_SIZE = 1024 * 1024
+
+class Mp3FormatError(ValueError):
+    """
+    Le fichier n'est pas un flux MP3 que la concaténation native sait traiter.
+    """
+
+class FrameHeader:
+    """
+    En-tête de trame MPEG audio décodé.
+    """
+    __slots__ = ('raw', 'version_bits', 'layer', 'bitrate_index', 'sample_rate_index',
+                 'sample_rate', 'bitrate', 'padding', 'channel_mode', 'frame_length',
+                 'samples_per_frame')
+
+    def __init__(self, raw):
+        b1, b2, b3 = raw[1], raw[2], raw[3]
+        self.raw = bytes(raw[:4])
+        self.version_bits = (b1 >> 3) & 0x3
+        self.layer = 4 - ((b1 >> 1) & 0x3)
+        self.bitrate_index = (b2 >> 4) & 0xF
+        self.sample_rate_index = (b2 >> 2) & 0x3
+        self.padding = (b2 >> 1) & 0x1
+        self.channel_mode = (b3 >> 6) & 0x3
+        if self.version_bits == 1 or self.layer == 4:
+            raise Mp3FormatError("Version ou couche MPEG réservée")
+        if self.bitrate_index in (0, 15) or self.sample_rate_index == 3:
+            raise Mp3FormatError("Débit ou fréquence d'échantillonnage invalide")
+        mpeg = 1 if self.version_bits == 3 else 2
+        self.sample_rate = SAMPLE_RATES[self.version_bits][self.sample_rate_index]
+        self.bitrate = BITRATES[(mpeg, self.layer)][self.bitrate_index] * 1000
+        if self.layer == 1:
+            self.samples_per_frame = 384
+            self.frame_length = (12 * self.bitrate // self.sample_rate + self.padding) * 4
+        else:
+            self.samples_per_frame = 1152 if (self.layer == 2 or mpeg == 1) else 576
+            self.frame_length = self.samples_per_frame // 8 * self.bitrate // self.sample_rate + self.padding
+
+    @property
+    def side_info_size(self):
+        mono = self.channel_mode == 3
+        if self.version_bits == 3:
+            return 17 if mono else 32
+        return 9 if mono else 17
+
+    def stream_format(self):
+        # Paramètres qui doivent être identiques pour concaténer deux flux sans réencodage
+        return (self.version_bits, self.layer, self.sample_rate, self.channel_mode == 3)
+
+def parse_frame_header(data, pos):
+    if data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        raise Mp3FormatError(f"Synchronisation de trame absente à l'octet {pos}")
+    return FrameHeader(data[pos:pos + 4])
+
+def _is_vbr_info_frame(data, pos, header):
+    offset = pos + 4 + header.side_info_size
+    if data[offset:offset + 4] in (b'Xing', b'Info'):
+        return True
+    return data[pos + 36:pos + 40] == b'VBRI'
+
+class Mp3Stream:
+    """
+    Résultat de l'analyse d'un fichier MP3 : plage d'octets contenant les
+    trames audio (sans étiquettes ID3 ni trame Xing/VBRI), nombre de trames
+    et en-tête de la première trame audio.
+    """
+    def __init__(self, start, end, frames, header, bitrates):
+        self.start = start
+        self.end = end
+        self.frames = frames
+        self.header = header
+        self.bitrates = bitrates
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+    @property
+    def duration(self):
+        return self.frames * self.header.samples_per_frame / self.header.sample_rate
+
+def scan_mp3(data):
+    """
+    Parcourt les en-têtes de trames d'un tampon MP3 complet.
+    Les étiquettes ID3v2, ID3v1 et APE ainsi que la trame Xing/Info/VBRI
+    éventuelle sont exclues de la plage retournée.
+    """
+    end = len(data)
+    pos = 0
+    if data[:3] == b'ID3' and end >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+    if end - pos >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+    if end - pos >= 32 and data[end - 32:end - 24] == b'APETAGEX':
+        tag_size, flags = struct.unpack('<II', data[end - 20:end - 12])
+        end -= tag_size + (32 if flags & 0x80000000 else 0)
+
+    # Ignorer d'éventuels octets de remplissage avant la première trame
+    while pos + 4 <= end and not (data[pos] == 0xFF and (data[pos + 1] & 0xE0) == 0xE0):
+        pos += 1
+    if pos + 4 > end:
+        raise Mp3FormatError("Aucune trame MP3 trouvée")
+
+    first = parse_frame_header(data, pos)
+    if _is_vbr_info_frame(data, pos, first):
+        pos += first.frame_length
+    start = pos
+    frames = 0
+    header = None
+    bitrates = set()
+    while pos + 4 <= end:
+        current = parse_frame_header(data, pos)
+        if pos + current.frame_length > end:
+            # Dernière trame tronquée : elle est écartée
+            break
+        if header is None:
+            header = current
+        elif current.stream_format() != header.stream_format():
+            raise Mp3FormatError(f"Format de trame incohérent à l'octet {pos}")
+        bitrates.add(current.bitrate_index)
+        frames += 1
+        pos += current.frame_length
+    if header is None:
+        raise Mp3FormatError("Aucune trame audio complète")
+    return Mp3Stream(start, pos, frames, header, bitrates)
+
+def build_xing_frame(header, total_frames, total_bytes, segments, cbr=False):
+    """
+    Construit une trame Xing (ou Info pour un flux à débit constant) compatible
+    avec le flux décrit par header. segments est la liste (trames, octets) des
+    morceaux concaténés, utilisée pour calculer la table des positions.
+    """
+    needed = 4 + header.side_info_size + 4 + 4 + 4 + 4 + TOC_SIZE
+    mpeg = 1 if header.version_bits == 3 else 2
+    # Plus petit débit dont la trame peut contenir l'en-tête Xing, sans remplissage
+    for bitrate_index in range(1, 15):
+        raw = bytes([0xFF,
+                     0xE0 | (header.version_bits << 3) | ((4 - header.layer) << 1) | 0x1,
+                     (bitrate_index << 4) | (header.sample_rate_index << 2),
+                     header.raw[3]])
+        candidate = FrameHeader(raw)
+        if candidate.frame_length >= needed:
+            break
+    else:
+        raise Mp3FormatError(f"Aucun débit MPEG{mpeg} ne permet d'écrire un en-tête Xing")
+
+    frame = bytearray(candidate.frame_length)
+    frame[0:4] = candidate.raw
+    frame_bytes = total_bytes + candidate.frame_length
+    offset = 4 + candidate.side_info_size
+    frame[offset:offset + 4] = b'Info' if cbr else b'Xing'
+    struct.pack_into('>III', frame, offset + 4, XING_FLAGS, total_frames, frame_bytes)
+    frame[offset + 16:offset + 16 + TOC_SIZE] = _build_toc(total_frames, frame_bytes,
+                                                          candidate.frame_length, segments)
+    return bytes(frame)
+
+def _build_toc(total_frames, total_bytes, first_offset, segments):
+    # Interpolation linéaire à l'intérieur de chaque morceau concaténé
+    toc = bytearray(TOC_SIZE)
+    if not total_frames:
+        return bytes(toc)
+    seg_iter = iter(segments)
+    seg_frames, seg_bytes = next(seg_iter, (0, 0))
+    frames_before, bytes_before = 0, first_offset
+    for k in range(TOC_SIZE):
+        target = total_frames * k / TOC_SIZE
+        while seg_frames and frames_before + seg_frames <= target:
+            frames_before += seg_frames
+            bytes_before += seg_bytes
+            seg_frames, seg_bytes = next(seg_iter, (0, 0))
+        position = bytes_before
+        if seg_frames:
+            position += (target - frames_before) / seg_frames * seg_bytes
+        toc[k] = min(255, int(256 * position / total_bytes))
+        if k and toc[k] < toc[k - 1]:
+            toc[k] = toc[k - 1]
+    return bytes(toc)
+
+def concat_mp3_files(input_files, output_file):
+    """
+    Concatène des fichiers MP3 de même format sans réencodage ni processus externe.
+    Les trames audio de chaque fichier sont recopiées par blocs depuis une
+    projection mémoire ; les étiquettes ID3 et trames Xing/VBRI individuelles
+    sont retirées et une trame Xing décrivant le fichier complet est écrite en tête.
+
+    :raises Mp3FormatError: si un fichier n'est pas un MP3 exploitable ou si les formats diffèrent
+    """
+    part_file = f"{output_file}.part"
+    header = None
+    segments = []
+    bitrates = set()
+    try:
+        with open(part_file, 'wb', buffering=COPY_BUFFER_SIZE) as out:
+            xing_size = 0
+            for input_file in input_files:
+                if os.path.getsize(input_file) == 0:
+                    raise Mp3FormatError(f"Fichier vide : {input_file}")
+                with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    try:
+                        stream = scan_mp3(mm)
+                    except (Mp3FormatError, IndexError) as e:
+                        raise Mp3FormatError(f"{input_file} : {e}") from e
+                    if header is None:
+                        header = stream.header
+                        # Réserver la place de la trame Xing, écrite une fois les totaux connus
+                        xing_size = len(build_xing_frame(header, 0, 0, []))
+                        out.write(bytes(xing_size))
+                    elif stream.header.stream_format() != header.stream_format():
+                        raise Mp3FormatError(f"{input_file} : format différent du premier fichier")
+                    with memoryview(mm) as view:
+                        for offset in range(stream.start, stream.end, COPY_BUFFER_SIZE):
+                            out.write(view[offset:min(offset + COPY_BUFFER_SIZE, stream.end)])
+                    segments.append((stream.frames, stream.size))
+                    bitrates |= stream.bitrates
+            if header is None:
+                raise Mp3FormatError("Aucun fichier à concaténer")
+
+            total_frames = sum(frames for frames, _ in segments)
+            total_bytes = sum(size for _, size in segments)
+            out.seek(0)
+            out.write(build_xing_frame(header, total_frames, total_bytes, segments, cbr=len(bitrates) == 1))
+        os.replace(part_file, output_file)
+    except BaseException:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    logging.debug(f"{len(segments)} fichiers MP3 concaténés dans {output_file} ({total_frames} trames)")
+    return total_frames
+
+class Mp3StreamWriter:
+    """
+    Écrit des segments MP3 complets les uns à la suite des autres dans un
+    fichier partiel, dont la première trame est réservée à l'en-tête Xing.
+    Un fichier partiel existant peut être repris : il est tronqué à la fin du
+    dernier segment confirmé (resume_segments, liste de (trames, octets)) qui
+    y figure réellement. Appeler flush() avant de confirmer un segment.
+    """
+    def __init__(self, path, resume_segments=()):
+        self.path = path
+        self.header = None
+        self.segments = []
+        self.bitrates = set()
+        self._resumed = False
+        self._file = None
+        if resume_segments and os.path.exists(path):
+            self._resume(list(resume_segments))
+        if self._file is None:
+            self._file = open(path, 'wb', buffering=COPY_BUFFER_SIZE)
+
+    def _resume(self, resume_segments):
+        with open(self.path, 'rb') as f:
+            raw = f.read(4)
+        try:
+            # La trame Xing provisoire porte le même format que le flux
+            placeholder = parse_frame_header(raw, 0)
+        except (Mp3FormatError, IndexError):
+            return
+        # Plus long préfixe des segments confirmés présent sur le disque : un arrêt brutal
+        # peut avoir perdu la fin du fichier si des segments ont été confirmés trop tôt
+        available = os.path.getsize(self.path)
+        size = placeholder.frame_length
+        kept = 0
+        for _, segment_size in resume_segments:
+            if size + segment_size > available:
+                break
+            size += segment_size
+            kept += 1
+        if not kept:
+            return
+        resume_segments = resume_segments[:kept]
+        self._file = open(self.path, 'r+b', buffering=COPY_BUFFER_SIZE)
+        self._file.truncate(size)
+        self._file.seek(size)
+        self.header = placeholder
+        self.segments = resume_segments
+        self._resumed = True
+
+    def append(self, data):
+        """
+        Ajoute un segment MP3 complet et retourne son analyse (Mp3Stream).
+        """
+        stream = scan_mp3(data)
+        if self.header is None:
+            self.header = stream.header
+            self._file.write(build_xing_frame(self.header, 0, 0, []))
+        elif stream.header.stream_format() != self.header.stream_format():
+            raise Mp3FormatError("Format de segment différent du début du flux")
+        with memoryview(data) as view:
+            self._file.write(view[stream.start:stream.end])
+        self.segments.append((stream.frames, stream.size))
+        self.bitrates |= stream.bitrates
+        return stream
+
+    def flush(self):
+        """
+        Transmet les segments écrits au système : ils survivent alors à l'arrêt du processus.
+        """
+        self._file.flush()
+
+    def finalize(self, output_file):
+        """
+        Écrit l'en-tête Xing définitif et renomme le fichier partiel en output_file.
+        """
+        if self.header is None:
+            raise Mp3FormatError("Aucun segment écrit")
+        total_frames = sum(frames for frames, _ in self.segments)
+        total_bytes = sum(size for _, size in self.segments)
+        cbr = not self._resumed and len(self.bitrates) == 1
+        self._file.seek(0)
+        self._file.write(build_xing_frame(self.header, total_frames, total_bytes, self.segments, cbr=cbr))
+        self.close()
+        os.replace(self.path, output_file)
+        return total_frames
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            finally:
+                self._file.close()
+                self._file = None
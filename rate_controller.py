@@ -0,0 +1,221 @@
+# rate_controller.py
+
+import re
+import time
+import bisect
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp est installé avec edge-tts
+    aiohttp = None
+try:
+    from edge_tts.exceptions import EdgeTTSException
+except ImportError:
+    EdgeTTSException = None
+
+# Codes HTTP indiquant que le service limite nos requêtes
+THROTTLE_STATUSES = (429, 503)
+# Exceptions dont le message provient du service (jamais du texte synthétisé) : seules
+# celles-ci sont reconnues à leur message lorsqu'elles ne portent pas de code HTTP
+SERVICE_ERROR_TYPES = tuple(t for t in (aiohttp and aiohttp.ClientError, EdgeTTSException) if t is not None)
+THROTTLE_MESSAGE = re.compile(r'\b429\b.*\bToo Many Requests\b|\bHTTP 429\b', re.IGNORECASE)
+
+# Réglages par défaut du contrôleur
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 8
+DECREASE_FACTOR = 0.5       # Réduction multiplicative de la limite en cas d'erreur ou de latence
+LATENCY_TOLERANCE = 2.0     # Latence jugée dégradée au-delà de ce multiple de la latence de référence
+LATENCY_SMOOTHING = 0.2     # Poids d'une nouvelle mesure dans la moyenne glissante de latence
+BASELINE_WINDOW = 200       # Succès récents dont la médiane sert de latence de référence
+LATENCY_STRIKES = 5         # Mesures lissées consécutives au-delà de la tolérance avant une réduction
+LATENCY_MIN_LIMIT = 2       # Plancher des réductions dues à la seule latence (les erreurs descendent à min_limit)
+MIN_BACKOFF = 1.0           # Pause après la première erreur consécutive (secondes)
+MAX_BACKOFF = 60.0          # Pause maximale entre deux vagues de requêtes
+THROTTLE_BACKOFF = 5.0      # Pause minimale après un refus explicite du service
+# La latence est ramenée à un bloc de LATENCY_UNIT_CHARS caractères, la durée de synthèse
+# dépendant de la longueur du texte ; les textes plus courts que MIN_LATENCY_CHARS
+# (titres) comptent pour MIN_LATENCY_CHARS, leur coût fixe dominant
+LATENCY_UNIT_CHARS = 1000
+MIN_LATENCY_CHARS = 200
+
+def is_throttle_error(error):
+    """
+    Indique si l'exception (ou l'une de ses causes) signale une limitation de débit du service.
+    """
+    while error is not None:
+        status = getattr(error, 'status', None) or getattr(error, 'status_code', None)
+        if status in THROTTLE_STATUSES:
+            return True
+        if isinstance(error, SERVICE_ERROR_TYPES) and THROTTLE_MESSAGE.search(str(error)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+class AdaptiveRateController:
+    """
+    Contrôleur AIMD du nombre de requêtes de synthèse en vol, partagé par tous
+    les chapitres (et tous les livres d'un même processus).
+
+    Chaque succès augmente la limite d'environ une requête par « fenêtre » de
+    requêtes réussies (augmentation additive). Une erreur ou un refus du service
+    la divise par deux (réduction multiplicative), au plus une fois par période
+    de latence, pour ne pas réagir plusieurs fois au même incident. La latence
+    lissée la réduit aussi, sans descendre sous LATENCY_MIN_LIMIT, lorsqu'elle
+    dépasse LATENCY_TOLERANCE fois la latence de référence (médiane des derniers
+    succès) pendant LATENCY_STRIKES mesures consécutives : les variations
+    ordinaires d'un service non saturé ne sont pas prises pour une congestion.
+    Les erreurs consécutives suspendent en plus les nouvelles requêtes pendant
+    une pause croissante, remise à zéro au premier succès.
+    """
+    def __init__(self, initial_limit=DEFAULT_INITIAL_LIMIT, min_limit=DEFAULT_MIN_LIMIT,
+                 max_limit=DEFAULT_MAX_LIMIT, on_change=None):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.on_change = on_change or (lambda state: None)
+        self.in_flight = 0
+        self.latency = None           # Moyenne glissante de la latence des requêtes réussies
+        self.baseline_latency = None  # Latence de référence : médiane des derniers succès
+        self._recent = deque(maxlen=BASELINE_WINDOW)  # Latences récentes, dans l'ordre d'arrivée
+        self._recent_sorted = []                      # Les mêmes, triées (calcul de la médiane)
+        self._latency_strikes = 0
+        self.consecutive_errors = 0
+        self.successes = 0
+        self.errors = 0
+        self.throttles = 0
+        self.decreases = 0
+        self._resume_at = 0.0         # Instant (time.monotonic) avant lequel aucune requête ne part
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self, size=None):
+        """
+        Réserve une place pour une requête ; la durée et l'issue du bloc ajustent la limite.
+
+        :param size: Nombre de caractères synthétisés, pour comparer des latences de textes de longueurs différentes
+        """
+        await self._acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.record_error(e)
+            raise
+        else:
+            latency = time.monotonic() - started
+            if size is not None:
+                latency *= LATENCY_UNIT_CHARS / max(size, MIN_LATENCY_CHARS)
+            self.record_success(latency)
+        finally:
+            await self._release()
+
+    async def _acquire(self):
+        async with self._condition:
+            while True:
+                delay = self._resume_at - time.monotonic()
+                if delay > 0:
+                    # Pause après des erreurs : réveil à la fin de la pause ou à un changement d'état
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                await self._condition.wait()
+
+    async def _release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def record_success(self, latency):
+        self.successes += 1
+        self.consecutive_errors = 0
+        self._resume_at = 0.0
+        self.latency = latency if self.latency is None else self.latency + LATENCY_SMOOTHING * (latency - self.latency)
+        latency_floor = min(self.max_limit, max(self.min_limit, LATENCY_MIN_LIMIT))
+        congested = self.baseline_latency is not None and self.latency > self.baseline_latency * LATENCY_TOLERANCE
+        # La référence n'apprend pas des mesures prises pendant une congestion, sauf au plancher :
+        # la réduction ne pouvant plus agir, le service est simplement devenu plus lent
+        if not congested or self.limit <= latency_floor:
+            self._update_baseline(latency)
+
+        self._latency_strikes = self._latency_strikes + 1 if congested else 0
+        if self._latency_strikes >= LATENCY_STRIKES:
+            self._latency_strikes = 0
+            self._decrease("latence en hausse", floor=latency_floor, level=logging.DEBUG)
+        elif self.limit < self.max_limit:
+            previous = int(self.limit)
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) != previous:
+                self._changed()
+
+    def _update_baseline(self, latency):
+        if len(self._recent) == self._recent.maxlen:
+            oldest = self._recent[0]
+            del self._recent_sorted[bisect.bisect_left(self._recent_sorted, oldest)]
+        self._recent.append(latency)
+        bisect.insort(self._recent_sorted, latency)
+        self.baseline_latency = self._recent_sorted[len(self._recent_sorted) // 2]
+
+    def record_error(self, error):
+        self.errors += 1
+        self.consecutive_errors += 1
+        throttled = is_throttle_error(error)
+        if throttled:
+            self.throttles += 1
+        backoff = min(MAX_BACKOFF, MIN_BACKOFF * 2 ** (self.consecutive_errors - 1))
+        if throttled:
+            backoff = max(backoff, THROTTLE_BACKOFF)
+        self._resume_at = max(self._resume_at, time.monotonic() + backoff)
+        self._decrease("service saturé" if throttled else "erreur de synthèse")
+
+    def _decrease(self, reason, floor=None, level=logging.WARNING):
+        now = time.monotonic()
+        # Une seule réduction par période de latence : les requêtes déjà en vol
+        # au moment de l'incident en subissent souvent les effets
+        floor = self.min_limit if floor is None else floor
+        if self.limit <= floor or now - self._last_decrease < (self.latency or MIN_BACKOFF):
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(floor, self.limit * DECREASE_FACTOR)
+        if self.latency is not None and self.baseline_latency is not None:
+            # Repartir d'une latence intermédiaire pour laisser à la réduction le temps d'agir
+            self.latency = min(self.latency, self.baseline_latency * (1 + LATENCY_TOLERANCE) / 2)
+        logging.log(level, f"Requêtes simultanées réduites à {int(self.limit)} ({reason})")
+        self._changed()
+
+    def _changed(self):
+        self.on_change(self.state())
+
+    def cooldown_remaining(self):
+        """
+        Secondes restantes avant que de nouvelles requêtes puissent partir.
+        """
+        return max(0.0, self._resume_at - time.monotonic())
+
+    def state(self):
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'baseline_latency': round(self.baseline_latency, 3) if self.baseline_latency is not None else None,
+            'successes': self.successes,
+            'errors': self.errors,
+            'throttles': self.throttles,
+            'decreases': self.decreases,
+            'cooldown': round(self.cooldown_remaining(), 3),
+        }
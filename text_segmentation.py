@@ -0,0 +1,138 @@
+# text_segmentation.py
+
+import re
+from collections import defaultdict
+
+# Taille maximale par défaut d'un bloc envoyé au service de synthèse (en caractères)
+DEFAULT_MAX_CHARS = 1000
+
+# Fin de phrase : espace précédé d'une ponctuation finale
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[.!?])\s+')
+# Fin de proposition : espace précédé d'une virgule, d'un point-virgule, de deux-points ou d'un tiret
+CLAUSE_SPLIT_PATTERN = re.compile(r'(?<=[,;:–—)])\s+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Version du découpage en phrases : elle entre dans la clé des travaux de synthèse,
+# les index de phrases d'un ancien journal ne correspondant plus après un changement
+SEGMENTER_VERSION = 2
+
+# Abréviations françaises courantes suivies d'un point, qui ne terminent pas la phrase
+ABBREVIATIONS = frozenset((
+    'm', 'mm', 'mme', 'mmes', 'mlle', 'mlles', 'mgr', 'me', 'dr', 'pr', 'st', 'ste',
+    'p', 'pp', 'cf', 'ex', 'env', 'vol', 'chap', 'fig', 'art', 'av', 'bd', 'ch', 'no',
+    'n°', 'éd', 'coll', 'trad', 'op', 'cit', 'ibid', 'id', 'sq', 'sqq', 'vs', 'min',
+))
+# Une phrase plus courte est regroupée avec la suivante (une requête de moins)
+MIN_SENTENCE_CHARS = 20
+
+def _abbreviation_guards(abbreviations):
+    # Un regard arrière par longueur d'abréviation (Python n'accepte que des largeurs fixes),
+    # placé après le point pour n'être évalué que sur les points candidats
+    by_length = defaultdict(list)
+    for abbreviation in abbreviations:
+        by_length[len(abbreviation)].append(re.escape(abbreviation))
+    return ''.join(f"(?<!\\b(?i:{'|'.join(sorted(words))})\\.)" for _, words in sorted(by_length.items()))
+
+# Fin de phrase : ponctuation finale ou points de suspension, guillemets ou parenthèses
+# fermants éventuels, puis au moins un espace. Un point isolé ne compte pas après une
+# abréviation ni après une initiale (« J. Verne »).
+BOUNDARY_PATTERN = re.compile(
+    r'(?:[!?…][.!?…]*|\.(?:[.!?…]+|(?<!\b[A-ZÀ-Þ]\.)' + _abbreviation_guards(ABBREVIATIONS) + r'))'
+    r'(?:[\s\u00a0]*[»”"’)\]])*\s+')
+
+def split_sentences(text):
+    """
+    Découpe un texte en phrases sur la ponctuation finale.
+    """
+    return SENTENCE_SPLIT_PATTERN.split(text)
+
+def iter_sentences(text, min_chars=MIN_SENTENCE_CHARS):
+    """
+    Génère les phrases d'un texte français en un seul passage. Les abréviations
+    (M., Mme, p., cf.), les initiales, les points de suspension et les guillemets
+    suivis d'une minuscule ne coupent pas la phrase ; les phrases de moins de
+    min_chars caractères sont regroupées avec la suivante.
+    """
+    previous = None  # Dernière phrase complète, retenue pour y rattacher un reliquat trop court
+    pending = ''
+    start = 0
+    length = len(text)
+    for match in BOUNDARY_PATTERN.finditer(text):
+        end = match.end()
+        if end >= length or text[end].islower():
+            # « etc. », points de suspension ou guillemets suivis d'une incise : même phrase
+            continue
+        sentence = text[start:end].strip()
+        start = end
+        if pending:
+            sentence = f"{pending} {sentence}"
+            pending = ''
+        if len(sentence) < min_chars:
+            pending = sentence
+            continue
+        if previous is not None:
+            yield previous
+        previous = sentence
+
+    rest = text[start:].strip()
+    if pending:
+        rest = f"{pending} {rest}".strip()
+    if rest and previous is not None and len(rest) < min_chars:
+        previous = f"{previous} {rest}"
+        rest = ''
+    if previous is not None:
+        yield previous
+    if rest:
+        yield rest
+
+def _pack(pieces, max_chars):
+    """
+    Regroupe des morceaux consécutifs, séparés par un espace, tant que le bloc
+    ne dépasse pas max_chars. Un morceau trop long est émis seul.
+    """
+    current = ''
+    for piece in pieces:
+        if not current:
+            current = piece
+        elif len(current) + 1 + len(piece) <= max_chars:
+            current = f"{current} {piece}"
+        else:
+            yield current
+            current = piece
+    if current:
+        yield current
+
+def split_long_sentence(sentence, max_chars=DEFAULT_MAX_CHARS):
+    """
+    Découpe une phrase trop longue aux limites de propositions, puis aux espaces
+    si une proposition dépasse encore max_chars. Un mot plus long que max_chars
+    est coupé arbitrairement en dernier recours.
+    """
+    if len(sentence) <= max_chars:
+        return [sentence]
+
+    pieces = []
+    for clause in CLAUSE_SPLIT_PATTERN.split(sentence):
+        if len(clause) <= max_chars:
+            pieces.append(clause)
+            continue
+        for word in WHITESPACE_PATTERN.split(clause):
+            while len(word) > max_chars:
+                pieces.append(word[:max_chars])
+                word = word[max_chars:]
+            if word:
+                pieces.append(word)
+    return list(_pack(pieces, max_chars))
+
+def pack_sentences(sentences, max_chars=DEFAULT_MAX_CHARS):
+    """
+    Regroupe des phrases consécutives en blocs d'au plus max_chars caractères,
+    sans jamais couper une phrase sauf si elle dépasse à elle seule la limite.
+    Les phrases vides sont ignorées.
+    """
+    def pieces():
+        for sentence in sentences:
+            sentence = sentence.strip()
+            if sentence:
+                yield from split_long_sentence(sentence, max_chars)
+    return list(_pack(pieces(), max_chars))
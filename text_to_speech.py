@@ -1,13 +1,19 @@
 # text_to_speech.py
 
 import asyncio
-import edge_tts
 import os
+import random
 import logging
-import tempfile
 import shutil
-import re
-import json
+import subprocess
+import time
+from text_segmentation import iter_sentences, pack_sentences, DEFAULT_MAX_CHARS, SEGMENTER_VERSION
+from audio_cache import AudioCache, get_default_cache
+from mp3_concat import concat_mp3_files, Mp3FormatError, Mp3StreamWriter
+from job_journal import JobJournal, make_job_key, job_temp_dir
+from tts_backends import EdgeTTSBackend
+from rate_controller import AdaptiveRateController, DEFAULT_INITIAL_LIMIT
+from metrics import ConversionMetrics
 
 # Définition des voix supportées
 SUPPORTED_VOICES = {
@@ -18,7 +24,41 @@ SUPPORTED_VOICES = {
     5: 'fr-FR-HenriNeural'
 }
 
-async def text_to_speech(text, voice_index=4, rate=0, volume=0, output_file="output.mp3", chapter_title=None):
+# Nombre de requêtes de synthèse simultanées par défaut
+DEFAULT_CONCURRENCY = 4
+# Nombre maximal de segments d'avance conservés en mémoire en mode flux
+DEFAULT_REORDER_WINDOW = 16
+# Tentatives par phrase avant de déclarer le chapitre en échec, et bornes de la pause
+# (aléatoire, doublée à chaque échec) entre deux tentatives, en secondes
+DEFAULT_SENTENCE_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Entrée du journal écrite une fois le fichier du chapitre publié par la fusion
+MERGED_ENTRY = 'merged'
+
+async def text_to_speech(text, voice_index=4, rate=0, volume=0, output_file="output.mp3", chapter_title=None,
+                         concurrency=DEFAULT_CONCURRENCY, rate_controller=None, merge_executor=None,
+                         max_chars=DEFAULT_MAX_CHARS, cache=None, use_cache=True,
+                         job_id=None, stream=False, reorder_window=DEFAULT_REORDER_WINDOW, backend=None,
+                         sentence_attempts=DEFAULT_SENTENCE_ATTEMPTS, metrics=None):
+    """
+    Convertit un texte en fichier audio, phrase par phrase.
+    
+    :param concurrency: Nombre maximal de requêtes de synthèse simultanées
+    :param rate_controller: Contrôleur adaptatif (AdaptiveRateController) partagé par plusieurs
+                            chapitres ; à défaut, un contrôleur limité à concurrency requêtes
+    :param merge_executor: Exécuteur utilisé pour la fusion des fichiers audio (pool par défaut si None)
+    :param max_chars: Taille maximale d'un bloc de phrases envoyé en une seule requête
+    :param cache: Cache audio à utiliser (cache partagé par défaut si None)
+    :param use_cache: Désactive complètement le cache audio si False
+    :param job_id: Identifiant stable du livre et du chapitre, utilisé pour retrouver la progression
+    :param stream: Écrire l'audio reçu directement dans le fichier du chapitre, sans fichier par phrase
+    :param reorder_window: Nombre maximal de segments d'avance en attente d'écriture (mode flux)
+    :param backend: Moteur de synthèse (tts_backends), Edge TTS par défaut
+    :param sentence_attempts: Nombre de tentatives par phrase ; le chapitre n'échoue
+                              qu'une fois ces tentatives épuisées pour une phrase
+    :param metrics: Mesures (metrics.ConversionMetrics) alimentées par les requêtes, le cache et la fusion
+    """
     chapter_name = os.path.basename(output_file)
     logging.info(f"=== Début de la conversion du chapitre : {chapter_name} ===")
     logging.info(f"Fichier de sortie : {output_file}")
@@ -26,43 +66,125 @@ async def text_to_speech(text, voice_index=4, rate=0, volume=0, output_file="out
     if voice_index not in SUPPORTED_VOICES:
         raise ValueError(f"Voice index '{voice_index}' is not supported. Choose from {list(SUPPORTED_VOICES.keys())}.")
     
-    # Créer un dossier temporaire unique pour ce chapitre
-    temp_dir = os.path.join(tempfile.gettempdir(), f'audiobook_temp_{os.getpid()}_{id(text)}')
+    if metrics is None:
+        metrics = ConversionMetrics()
+    
+    # Moteur créé ici : ses connexions sont fermées à la fin du chapitre
+    owns_backend = backend is None
+    if owns_backend:
+        backend = EdgeTTSBackend()
+
+    # Dossier temporaire déterminé par le livre, le chapitre et les réglages,
+    # afin qu'une conversion interrompue reprenne là où elle s'est arrêtée
+    job_key = make_job_key(job_id, text, voice_index, rate, volume, max_chars, chapter_title, stream, backend.name,
+                           SEGMENTER_VERSION)
+    temp_dir = job_temp_dir(job_key)
     os.makedirs(temp_dir, exist_ok=True)
     logging.info(f"Dossier temporaire créé : {temp_dir}")
     
-    # Fichier de suivi des phrases générées
-    progress_file = os.path.join(temp_dir, "progress.json")
+    # Journal de suivi des phrases générées
+    journal = JobJournal(temp_dir)
     failed_sentences_file = os.path.join(temp_dir, "failed_sentences.txt")
+    # Vrai une fois le fichier du chapitre publié par cette exécution : seul cas où les
+    # segments et le journal de reprise peuvent être supprimés
+    completed = False
     
     try:
-        # Diviser le texte en phrases
-        sentences = re.split(r'(?<=[.!?])\s+', text)
+        # Diviser le texte en phrases, puis les regrouper en blocs pour limiter le nombre de requêtes
+        sentences = pack_sentences(iter_sentences(text), max_chars)
         total_sentences = len(sentences)
-        logging.info(f"Nombre total de phrases à convertir : {total_sentences}")
+        logging.info(f"Nombre total de blocs à convertir : {total_sentences} (max {max_chars} caractères par bloc)")
         
         # Charger la progression existante si elle existe
-        progress = {}
-        if os.path.exists(progress_file):
-            with open(progress_file, 'r', encoding='utf-8') as f:
-                progress = json.load(f)
+        entries = journal.load()
+        if entries.pop(MERGED_ENTRY, None) and os.path.exists(output_file):
+            # Fusion terminée après l'arrêt de l'exécution qui l'avait lancée
+            logging.info(f"Fichier déjà fusionné par une exécution précédente : {output_file}")
+            completed = True
+            return
+        progress = {i: entry['ok'] for i, entry in entries.items()}
+        if progress:
             logging.info(f"Progression précédente chargée : {len(progress)} phrases traitées")
         
         # Liste pour suivre les échecs
         failed_sentences = []
         
+        # Contrôleur adaptatif du nombre de requêtes en vol
+        if rate_controller is None:
+            rate_controller = AdaptiveRateController(initial_limit=min(DEFAULT_INITIAL_LIMIT, concurrency),
+                                                     max_limit=max(1, concurrency))
+        
+        if use_cache and cache is None:
+            cache = get_default_cache()
+        
+        # Paramètres de la voix principale
+        main_voice = SUPPORTED_VOICES[voice_index]
+        rate_str = f"+{rate}%" if rate >= 0 else f"{rate}%"
+        volume_str = f"+{volume}%" if volume >= 0 else f"{volume}%"
+        
+        async def synthesize_to_file(content, voice, audio_file):
+            # Réutiliser un segment déjà synthétisé avec les mêmes paramètres
+            cache_key = AudioCache.make_key(content, voice, rate_str, volume_str, backend.name)
+            if cache is not None:
+                hit = cache.get(cache_key, audio_file)
+                metrics.record_cache(hit, len(content), os.path.getsize(audio_file) if hit else 0)
+                if hit:
+                    return True
+            async def attempt():
+                async with rate_controller.slot(len(content)):
+                    started = time.monotonic()
+                    try:
+                        await backend.synthesize(content, voice, rate_str, volume_str, audio_file)
+                    except BaseException as e:
+                        # Ne pas laisser un fichier partiel passer pour un segment terminé
+                        if os.path.exists(audio_file):
+                            os.remove(audio_file)
+                        if isinstance(e, Exception):
+                            metrics.record_error(e)
+                        raise
+                    metrics.observe_request(time.monotonic() - started, len(content), os.path.getsize(audio_file))
+            await with_retries(attempt, content, sentence_attempts, metrics)
+            if cache is not None:
+                cache.put(cache_key, audio_file)
+            return False
+        
+        async def synthesize_to_bytes(content, voice):
+            cache_key = AudioCache.make_key(content, voice, rate_str, volume_str, backend.name)
+            if cache is not None:
+                data = cache.get_bytes(cache_key)
+                metrics.record_cache(data is not None, len(content), len(data) if data is not None else 0)
+                if data is not None:
+                    return data
+            async def attempt():
+                async with rate_controller.slot(len(content)):
+                    started = time.monotonic()
+                    try:
+                        data = await backend.synthesize_bytes(content, voice, rate_str, volume_str)
+                    except Exception as e:
+                        metrics.record_error(e)
+                        raise
+                    metrics.observe_request(time.monotonic() - started, len(content), len(data))
+                    return data
+            data = await with_retries(attempt, content, sentence_attempts, metrics)
+            if cache is not None:
+                cache.put_bytes(cache_key, data)
+            return data
+        
+        if stream:
+            # Le titre puis les blocs, écrits dans l'ordre directement dans le fichier du chapitre
+            items = [('title', chapter_title, 'fr-FR-HenriNeural')] if chapter_title else []
+            items.extend((i, sentence, main_voice) for i, sentence in enumerate(sentences))
+            await stream_segments(items, output_file, journal, synthesize_to_bytes, reorder_window)
+            completed = True
+            logging.info(f"Audio généré avec succès : {output_file}")
+            return
+        
         # Générer l'audio pour le titre si nécessaire
         if chapter_title:
             title_file = os.path.join(temp_dir, "title.mp3")
             if not os.path.exists(title_file):
                 try:
-                    communicate_title = edge_tts.Communicate(
-                        chapter_title, 
-                        'fr-FR-HenriNeural',
-                        rate=f"+{rate}%" if rate >= 0 else f"{rate}%",
-                        volume=f"+{volume}%" if volume >= 0 else f"{volume}%"
-                    )
-                    await communicate_title.save(title_file)
+                    await synthesize_to_file(chapter_title, 'fr-FR-HenriNeural', title_file)
                     logging.info(f"Titre généré avec succès : {chapter_title}")
                 except Exception as e:
                     error_msg = f"Erreur lors de la génération du titre : {e}"
@@ -71,49 +193,30 @@ async def text_to_speech(text, voice_index=4, rate=0, volume=0, output_file="out
                     raise
         
         # Générer l'audio pour chaque phrase
-        main_voice = SUPPORTED_VOICES[voice_index]
-        rate_str = f"+{rate}%" if rate >= 0 else f"{rate}%"
-        volume_str = f"+{volume}%" if volume >= 0 else f"{volume}%"
-        
-        for i, sentence in enumerate(sentences):
-            if not sentence.strip():
-                logging.debug(f"Phrase {i+1} vide, ignorée")
-                continue
-                
+        async def synthesize_sentence(i, sentence):
             sentence_file = os.path.join(temp_dir, f"sentence_{i:04d}.mp3")
-            
-            # Vérifier si la phrase a déjà été générée avec succès
-            if str(i) in progress and progress[str(i)] and os.path.exists(sentence_file):
-                logging.debug(f"Phrase {i+1}/{total_sentences} déjà générée")
-                continue
-            
             try:
                 logging.info(f"Génération de la phrase {i+1}/{total_sentences}")
                 logging.debug(f"Contenu de la phrase : {sentence[:100]}...")  # Log des 100 premiers caractères
                 
-                communicate = edge_tts.Communicate(
-                    sentence, 
-                    main_voice,
-                    rate=rate_str,
-                    volume=volume_str
-                )
-                await communicate.save(sentence_file)
-                progress[str(i)] = True
+                from_cache = await synthesize_to_file(sentence, main_voice, sentence_file)
+                progress[i] = True
                 
                 # Sauvegarder la progression
-                with open(progress_file, 'w', encoding='utf-8') as f:
-                    json.dump(progress, f)
+                journal.record(i, True)
                     
-                logging.info(f"✓ Phrase {i+1}/{total_sentences} générée avec succès")
+                if from_cache:
+                    logging.info(f"✓ Phrase {i+1}/{total_sentences} récupérée depuis le cache")
+                else:
+                    logging.info(f"✓ Phrase {i+1}/{total_sentences} générée avec succès")
                 
             except Exception as e:
                 error_msg = f"❌ Erreur lors de la génération de la phrase {i+1}: {e}"
                 logging.error(error_msg)
-                progress[str(i)] = False
+                progress[i] = False
                 failed_sentences.append((i+1, sentence[:100], str(e)))  # Stocke les 100 premiers caractères
                 
-                with open(progress_file, 'w', encoding='utf-8') as f:
-                    json.dump(progress, f)
+                journal.record(i, False)
                 
                 # Sauvegarder les détails des phrases échouées
                 with open(failed_sentences_file, 'a', encoding='utf-8') as f:
@@ -124,10 +227,28 @@ async def text_to_speech(text, voice_index=4, rate=0, volume=0, output_file="out
                 
                 raise
         
+        pending = []
+        for i, sentence in enumerate(sentences):
+            if not sentence.strip():
+                logging.debug(f"Phrase {i+1} vide, ignorée")
+                continue
+                
+            sentence_file = os.path.join(temp_dir, f"sentence_{i:04d}.mp3")
+            
+            # Vérifier si la phrase a déjà été générée avec succès
+            if progress.get(i) and os.path.exists(sentence_file):
+                logging.debug(f"Phrase {i+1}/{total_sentences} déjà générée")
+                continue
+            
+            pending.append((i, sentence))
+        
+        # Lancer les synthèses en parallèle ; l'ordre des fichiers est garanti par leur index
+        await run_bounded(synthesize_sentence(i, sentence) for i, sentence in pending)
+        
         # Vérifier que toutes les phrases ont été générées
         missing_sentences = [i for i, status in progress.items() if not status]
         if missing_sentences:
-            error_msg = f"Phrases manquantes dans {chapter_name} : {', '.join(missing_sentences)}"
+            error_msg = f"Phrases manquantes dans {chapter_name} : {', '.join(str(i) for i in missing_sentences)}"
             logging.error(error_msg)
             raise Exception(error_msg)
         
@@ -139,6 +260,10 @@ async def text_to_speech(text, voice_index=4, rate=0, volume=0, output_file="out
             logging.error(f"Phrases échouées : {len(failed_sentences)}")
             for num, content, error in failed_sentences:
                 logging.error(f"- Phrase {num}: {content}... | Erreur: {error}")
+        if cache is not None:
+            stats = cache.stats()
+            logging.info(f"Cache audio : {stats['hits']} succès, {stats['misses']} échecs, "
+                         f"{stats['entries']} entrées ({stats['bytes']} octets)")
         
         # Créer la liste des fichiers à concaténer
         files_to_merge = []
@@ -151,18 +276,12 @@ async def text_to_speech(text, voice_index=4, rate=0, volume=0, output_file="out
             if os.path.exists(os.path.join(temp_dir, f"sentence_{i:04d}.mp3"))
         ])
         
-        # Créer le fichier de concaténation pour ffmpeg
-        concat_file = os.path.join(temp_dir, "concat.txt")
-        with open(concat_file, 'w', encoding='utf-8') as f:
-            for audio_file in files_to_merge:
-                f.write(f"file '{audio_file}'\n")
-        
-        # Fusionner tous les fichiers
-        cmd = f'ffmpeg -y -f concat -safe 0 -i "{concat_file}" -c copy "{output_file}"'
-        result = os.system(cmd)
-        
-        if result != 0:
-            raise Exception("Erreur lors de la fusion des fichiers audio")
+        # Fusionner tous les fichiers dans un thread pour ne pas bloquer la boucle asyncio
+        loop = asyncio.get_running_loop()
+        merge_started = time.monotonic()
+        await loop.run_in_executor(merge_executor, merge_and_record, files_to_merge, output_file, temp_dir)
+        metrics.observe_merge(time.monotonic() - merge_started)
+        completed = True
         
         logging.info(f"Audio généré avec succès : {output_file}")
         
@@ -172,7 +291,10 @@ async def text_to_speech(text, voice_index=4, rate=0, volume=0, output_file="out
         raise e
         
     finally:
-        if os.path.exists(output_file):
+        journal.close()
+        if owns_backend:
+            await backend.aclose()
+        if completed:
             try:
                 shutil.rmtree(temp_dir)
                 logging.info(f"Dossier temporaire nettoyé : {temp_dir}")
@@ -181,6 +303,144 @@ async def text_to_speech(text, voice_index=4, rate=0, volume=0, output_file="out
         
         logging.info(f"=== Fin de la conversion du chapitre : {chapter_name} ===\n")
 
+def retry_delay(attempt):
+    """
+    Pause avant la tentative suivante : tirée au hasard entre 0 et une borne qui double
+    à chaque échec, pour que les requêtes échouées ensemble ne repartent pas ensemble.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+async def with_retries(operation, content, max_attempts=DEFAULT_SENTENCE_ATTEMPTS, metrics=None):
+    """
+    Exécute operation() (coroutine) jusqu'à max_attempts fois et retourne son résultat ;
+    la dernière erreur est propagée une fois les tentatives épuisées.
+    Les nouvelles tentatives sont comptées dans metrics s'il est fourni.
+    """
+    for attempt in range(1, max(1, max_attempts) + 1):
+        try:
+            return await operation()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if attempt >= max_attempts:
+                raise
+            delay = retry_delay(attempt)
+            logging.warning(f"Échec de la synthèse ({e}), tentative {attempt + 1}/{max_attempts} "
+                            f"dans {delay:.1f} s : {content[:50]}...")
+            if metrics is not None:
+                metrics.record_retry()
+            await asyncio.sleep(delay)
+
+async def stream_segments(items, output_file, journal, synthesize, reorder_window=DEFAULT_REORDER_WINDOW):
+    """
+    Synthétise les segments (clé, texte, voix) en parallèle et ajoute leur audio,
+    dans l'ordre, au fichier partiel du chapitre. Les résultats arrivés en avance
+    attendent dans un petit tampon de réordonnancement ; au-delà de reorder_window
+    segments d'avance, les synthèses suivantes attendent avant de démarrer.
+    """
+    # Reprise : on conserve les segments consécutifs déjà confirmés par le journal
+    entries = journal.load()
+    resume_segments = []
+    for key, _, _ in items:
+        entry = entries.get(key)
+        if not (entry and entry.get('ok') and 'frames' in entry):
+            break
+        resume_segments.append((entry['frames'], entry['bytes']))
+    writer = Mp3StreamWriter(f"{output_file}.part", resume_segments)
+    next_position = len(writer.segments)
+    if next_position:
+        logging.info(f"Reprise du flux après {next_position} segments déjà écrits")
+    if next_position < len(resume_segments):
+        logging.warning(f"Fin du fichier partiel perdue : reprise après {next_position} segments "
+                        f"sur {len(resume_segments)} confirmés")
+    
+    reorder_buffer = {}
+    condition = asyncio.Condition()
+    
+    async def produce(position):
+        nonlocal next_position
+        key, content, voice = items[position]
+        async with condition:
+            await condition.wait_for(lambda: position < next_position + reorder_window)
+        data = await synthesize(content, voice)
+        async with condition:
+            reorder_buffer[position] = data
+            written = []
+            while next_position in reorder_buffer:
+                written.append((items[next_position][0], writer.append(reorder_buffer.pop(next_position))))
+                next_position += 1
+            if written:
+                # Les segments doivent être dans le fichier avant d'être confirmés par le journal
+                writer.flush()
+                for key, stream in written:
+                    journal.record(key, True, frames=stream.frames, bytes=stream.size)
+            condition.notify_all()
+    
+    try:
+        await run_bounded(produce(position) for position in range(next_position, len(items)))
+        writer.finalize(output_file)
+    finally:
+        writer.close()
+
+def merge_audio_files(files_to_merge, output_file, temp_dir):
+    """
+    Fusionne les fichiers audio dans l'ordre donné, sans processus externe
+    si possible, avec ffmpeg sinon.
+    Fonction bloquante, destinée à être exécutée dans un thread.
+    """
+    try:
+        concat_mp3_files(files_to_merge, output_file)
+        return
+    except Mp3FormatError as e:
+        logging.warning(f"Concaténation native impossible ({e}), utilisation de ffmpeg")
+    merge_with_ffmpeg(files_to_merge, output_file, temp_dir)
+
+def merge_and_record(files_to_merge, output_file, temp_dir):
+    """
+    Fusionne les fichiers puis note la fusion dans le journal de la tâche. Une fusion
+    poursuivie après l'annulation du chapitre publie quand même son fichier : le journal
+    évite alors de la refaire à la reprise.
+    """
+    merge_audio_files(files_to_merge, output_file, temp_dir)
+    with JobJournal(temp_dir) as journal:
+        journal.record(MERGED_ENTRY, True)
+
+def merge_with_ffmpeg(files_to_merge, output_file, temp_dir):
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise Exception("Erreur lors de la fusion des fichiers audio : ffmpeg n'a pas été trouvé")
+    
+    # Créer le fichier de concaténation pour ffmpeg (les apostrophes sont échappées selon sa syntaxe)
+    concat_file = os.path.join(temp_dir, "concat.txt")
+    with open(concat_file, 'w', encoding='utf-8') as f:
+        for audio_file in files_to_merge:
+            escaped = audio_file.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    
+    # Fusionner tous les fichiers
+    cmd = [ffmpeg, '-y', '-f', 'concat', '-safe', '0', '-i', concat_file, '-c', 'copy', output_file]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    
+    if result.returncode != 0:
+        logging.error(f"Sortie d'erreur de ffmpeg : {result.stderr}")
+        raise Exception("Erreur lors de la fusion des fichiers audio")
+
+async def run_bounded(coroutines):
+    """
+    Exécute des coroutines en parallèle et annule les autres dès qu'une échoue.
+    La limite de parallélisme est assurée par les coroutines elles-mêmes (sémaphore).
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coroutines]
+    if not tasks:
+        return []
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 async def convert_chapters(self, output_dir, voice_index=4, rate=0, volume=0):
     for i, chapitre in enumerate(self.chapitres, start=1):
         if chapitre['content'].strip():
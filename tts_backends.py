@@ -0,0 +1,140 @@
+# tts_backends.py
+
+import abc
+import asyncio
+import math
+
+try:
+    import edge_tts
+except ImportError:  # Le moteur hors ligne reste utilisable sans edge-tts
+    edge_tts = None
+
+try:
+    from tts_sessions import SessionPool, DEFAULT_POOL_SIZE, EDGE_INTERNALS_AVAILABLE
+except ImportError:  # aiohttp est installé avec edge-tts
+    SessionPool = None
+    DEFAULT_POOL_SIZE = 8
+    EDGE_INTERNALS_AVAILABLE = False
+
+class TTSBackend(abc.ABC):
+    """
+    Interface commune des moteurs de synthèse vocale. Les débits et volumes
+    sont exprimés comme pour edge-tts (ex. « +10% », « -5% »). Un moteur doit
+    définir list_voices et stream ; il ne peut pas être instancié sinon.
+    """
+    name = None
+    # Format audio produit, identique pour tous les moteurs afin que les
+    # segments puissent être concaténés sans réencodage
+    output_format = 'audio-24khz-48kbitrate-mono-mp3'
+
+    @abc.abstractmethod
+    async def list_voices(self):
+        """
+        Retourne les noms des voix disponibles.
+        """
+
+    @abc.abstractmethod
+    async def stream(self, text, voice, rate='+0%', volume='+0%'):
+        """
+        Générateur asynchrone des morceaux audio (bytes) au fur et à mesure de la synthèse.
+        """
+
+    async def synthesize_bytes(self, text, voice, rate='+0%', volume='+0%'):
+        chunks = [chunk async for chunk in self.stream(text, voice, rate, volume)]
+        data = b''.join(chunks)
+        if not data:
+            raise Exception(f"Aucun audio reçu pour : {text[:100]}")
+        return data
+
+    async def synthesize(self, text, voice, rate, volume, output_file):
+        data = await self.synthesize_bytes(text, voice, rate, volume)
+        with open(output_file, 'wb') as f:
+            f.write(data)
+
+    async def aclose(self):
+        """
+        Libère les ressources du moteur (connexions, processus).
+        """
+
+class EdgeTTSBackend(TTSBackend):
+    """
+    Service de synthèse en ligne Microsoft Edge. Les requêtes passent par un lot
+    de connexions websocket réutilisées (tts_sessions) plutôt que par une
+    connexion edge_tts.Communicate par texte. Si la version d'edge-tts installée
+    n'offre pas les fonctions internes utilisées par ce lot, le service Edge est
+    joint par edge_tts.Communicate.
+
+    :param url: Adresse websocket du service (serveur local de test par exemple), Edge par défaut
+    :param pool_size: Nombre de connexions inactives conservées
+    """
+    name = 'edge'
+
+    def __init__(self, url=None, pool_size=DEFAULT_POOL_SIZE):
+        if url is None and edge_tts is None or url is not None and SessionPool is None:
+            raise RuntimeError("Le moteur 'edge' nécessite le paquet edge-tts (pip install edge-tts)")
+        use_pool = SessionPool is not None and (url is not None or EDGE_INTERNALS_AVAILABLE)
+        self.pool = SessionPool(url=url, size=pool_size) if use_pool else None
+
+    async def list_voices(self):
+        voices = await edge_tts.list_voices()
+        return [voice['ShortName'] for voice in voices]
+
+    async def stream(self, text, voice, rate='+0%', volume='+0%'):
+        if self.pool is None:
+            communicate = edge_tts.Communicate(text, voice, rate=rate, volume=volume)
+            async for chunk in communicate.stream():
+                if chunk["type"] == "audio":
+                    yield chunk["data"]
+            return
+        async for data in self.pool.stream(text, voice, rate, volume):
+            yield data
+
+    async def aclose(self):
+        if self.pool is not None:
+            await self.pool.aclose()
+
+class SilenceBackend(TTSBackend):
+    """
+    Moteur hors ligne et déterministe : produit des trames MP3 silencieuses
+    au même format qu'Edge, d'une durée proportionnelle à la longueur du texte.
+    Permet d'exécuter et de mesurer toute la chaîne sans réseau.
+    """
+    name = 'silence'
+    CHARS_PER_SECOND = 15.0
+    # Trame MPEG-2 couche III, 48 kbit/s, 24 kHz, mono, sans CRC : 144 octets, 24 ms
+    FRAME_HEADER = bytes([0xFF, 0xF3, 0x64, 0xC0])
+    FRAME_SIZE = 144
+    FRAME_SECONDS = 576 / 24000
+    FRAMES_PER_CHUNK = 64
+
+    def __init__(self, latency=0.0):
+        self.latency = latency  # Délai simulé par requête, en secondes
+        # Informations annexes et données principales nulles : le décodeur produit du silence
+        self._frame = self.FRAME_HEADER + bytes(self.FRAME_SIZE - len(self.FRAME_HEADER))
+
+    async def list_voices(self):
+        return ['silence']
+
+    def duration(self, text, rate='+0%'):
+        speed = 1 + int(rate.rstrip('%')) / 100
+        return len(text) / (self.CHARS_PER_SECOND * max(speed, 0.1))
+
+    async def stream(self, text, voice, rate='+0%', volume='+0%'):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        frames = max(1, math.ceil(self.duration(text, rate) / self.FRAME_SECONDS))
+        for start in range(0, frames, self.FRAMES_PER_CHUNK):
+            yield self._frame * min(self.FRAMES_PER_CHUNK, frames - start)
+
+BACKENDS = {
+    EdgeTTSBackend.name: EdgeTTSBackend,
+    SilenceBackend.name: SilenceBackend,
+}
+
+def get_backend(name='edge', **options):
+    """
+    Instancie le moteur de synthèse correspondant à name.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Moteur de synthèse inconnu : {name}. Choisissez parmi {list(BACKENDS)}.")
+    return BACKENDS[name](**options)
@@ -0,0 +1,361 @@
+# tts_sessions.py
+#
+# Connexions websocket réutilisables vers le service de synthèse Edge.
+# edge_tts.Communicate ouvre une connexion (poignée de main TLS et websocket)
+# par texte ; ici un petit nombre de connexions restent ouvertes et les
+# requêtes s'y succèdent, une à la fois par connexion.
+
+import ssl
+import time
+import uuid
+import asyncio
+import logging
+from xml.sax.saxutils import escape
+
+import aiohttp
+
+try:
+    from edge_tts.constants import WSS_URL, WSS_HEADERS
+except ImportError:  # edge-tts absent : seule une adresse explicite (serveur local) est utilisable
+    WSS_URL = None
+    WSS_HEADERS = {}
+
+# Fonctions internes d'edge-tts (hors de son interface publique, vérifiées avec edge-tts 7.x) :
+# sans elles, le service Edge est joint par edge_tts.Communicate (voir tts_backends)
+try:
+    from edge_tts.constants import SEC_MS_GEC_VERSION
+    from edge_tts.communicate import remove_incompatible_characters, split_text_by_byte_length
+    from edge_tts.drm import DRM
+    DRM.generate_sec_ms_gec, DRM.headers_with_muid, DRM.handle_client_response_error
+except (ImportError, AttributeError):
+    SEC_MS_GEC_VERSION = None
+    remove_incompatible_characters = None
+    split_text_by_byte_length = None
+    DRM = None
+EDGE_INTERNALS_AVAILABLE = DRM is not None
+
+try:
+    import certifi
+    SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+except ImportError:
+    SSL_CONTEXT = None
+
+# Connexions inactives conservées par défaut
+DEFAULT_POOL_SIZE = 8
+# Une connexion inactive depuis plus longtemps est vérifiée (ping) avant d'être réutilisée,
+# et fermée au-delà de MAX_IDLE_SECONDS, le service coupant les connexions inactives
+HEALTH_CHECK_IDLE_SECONDS = 15.0
+MAX_IDLE_SECONDS = 120.0
+# Nombre de requêtes après lequel une connexion est renouvelée
+MAX_REQUESTS_PER_SESSION = 200
+CONNECT_TIMEOUT = 10
+RECEIVE_TIMEOUT = 60
+PING_TIMEOUT = 5
+CLOSE_TIMEOUT = 1
+# Taille maximale d'un texte par requête SSML, comme edge-tts
+MAX_SSML_TEXT_BYTES = 4096
+OUTPUT_FORMAT = 'audio-24khz-48kbitrate-mono-mp3'
+
+class SessionError(Exception):
+    """
+    Réponse inattendue du service ou connexion perdue pendant une requête.
+    """
+
+def connect_id():
+    return uuid.uuid4().hex
+
+def date_to_string():
+    # Format de date JavaScript attendu par le service
+    return time.strftime("%a %b %d %Y %H:%M:%S GMT+0000 (Coordinated Universal Time)", time.gmtime())
+
+def parse_headers(data):
+    """
+    Sépare les en-têtes (« Clé:valeur » séparés par CRLF) du corps d'un message.
+    """
+    head, _, body = data.partition(b"\r\n\r\n")
+    headers = {}
+    for line in head.split(b"\r\n"):
+        key, _, value = line.partition(b":")
+        headers[key] = value
+    return headers, body
+
+def parse_binary_message(data):
+    """
+    Décode un message binaire : deux octets (gros-boutiste) donnant la longueur
+    des en-têtes, les en-têtes, puis les données audio.
+    """
+    if len(data) < 2:
+        raise SessionError("Message binaire sans longueur d'en-têtes")
+    header_length = int.from_bytes(data[:2], 'big')
+    if header_length + 2 > len(data):
+        raise SessionError("Longueur d'en-têtes supérieure à la taille du message")
+    headers, _ = parse_headers(data[2:2 + header_length])
+    return headers, data[2 + header_length:]
+
+def split_text(text):
+    """
+    Nettoie et échappe le texte pour le SSML, puis le découpe en morceaux acceptés par le service.
+    """
+    if split_text_by_byte_length is not None:
+        return list(split_text_by_byte_length(escape(remove_incompatible_characters(text)), MAX_SSML_TEXT_BYTES))
+    data = escape(text).encode('utf-8')
+    return [data] if data.strip() else []
+
+def make_ssml(text, voice, rate, volume, pitch='+0Hz'):
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return ("<speak version='1.0' xmlns='http://www.w3.org/2001/10/synthesis' xml:lang='en-US'>"
+            f"<voice name='{voice}'><prosody pitch='{pitch}' rate='{rate}' volume='{volume}'>"
+            f"{text}</prosody></voice></speak>")
+
+def config_message():
+    return (f"X-Timestamp:{date_to_string()}\r\n"
+            "Content-Type:application/json; charset=utf-8\r\n"
+            "Path:speech.config\r\n\r\n"
+            '{"context":{"synthesis":{"audio":{"metadataoptions":{'
+            '"sentenceBoundaryEnabled":"false","wordBoundaryEnabled":"false"},'
+            f'"outputFormat":"{OUTPUT_FORMAT}"'
+            '}}}}\r\n')
+
+def ssml_message(request_id, ssml):
+    return (f"X-RequestId:{request_id}\r\n"
+            "Content-Type:application/ssml+xml\r\n"
+            f"X-Timestamp:{date_to_string()}Z\r\n"
+            "Path:ssml\r\n\r\n"
+            f"{ssml}")
+
+class TTSSession:
+    """
+    Connexion websocket au service, réutilisée pour des requêtes successives.
+    La configuration de sortie (speech.config) est envoyée une fois par connexion.
+    """
+    def __init__(self, http, url, headers=None, receive_timeout=RECEIVE_TIMEOUT):
+        self.http = http
+        self.url = url
+        self.headers = headers or {}
+        self.receive_timeout = receive_timeout
+        self.ws = None
+        self.requests = 0
+        self.created_at = None
+        self.last_used = None
+        self.broken = False  # Connexion dans un état incertain après une erreur : à fermer
+
+    @property
+    def closed(self):
+        return self.ws is None or self.ws.closed
+
+    async def connect(self):
+        separator = '&' if '?' in self.url else '?'
+        url = f"{self.url}{separator}ConnectionId={connect_id()}"
+        if DRM is not None and self.url == WSS_URL:
+            url += f"&Sec-MS-GEC={DRM.generate_sec_ms_gec()}&Sec-MS-GEC-Version={SEC_MS_GEC_VERSION}"
+        headers = DRM.headers_with_muid(self.headers) if DRM is not None and self.url == WSS_URL else self.headers
+        # Pings traités ici (autoping désactivé) pour que la vérification de santé voie le pong
+        options = {'ssl': SSL_CONTEXT} if SSL_CONTEXT is not None and url.startswith('wss:') else {}
+        self.ws = await self.http.ws_connect(url, headers=headers, compress=15, autoping=False, **options)
+        await self.ws.send_str(config_message())
+        self.created_at = self.last_used = time.monotonic()
+
+    async def is_healthy(self):
+        """
+        Vérifie par un ping qu'une connexion restée inactive répond encore.
+        """
+        if self.closed or self.broken:
+            return False
+        if time.monotonic() - self.last_used < HEALTH_CHECK_IDLE_SECONDS:
+            return True
+        try:
+            await self.ws.ping()
+            while True:
+                message = await self.ws.receive(timeout=PING_TIMEOUT)
+                if message.type == aiohttp.WSMsgType.PONG:
+                    return True
+                if message.type == aiohttp.WSMsgType.PING:
+                    await self.ws.pong(message.data)
+                    continue
+                # Fermeture, erreur ou message hors requête : connexion inutilisable
+                return False
+        except (asyncio.TimeoutError, ConnectionError, RuntimeError, aiohttp.ClientError):
+            return False
+
+    async def stream(self, text, voice, rate='+0%', volume='+0%'):
+        """
+        Générateur asynchrone des morceaux audio du texte. En cas d'erreur la connexion
+        est marquée comme inutilisable (broken), le service pouvant encore envoyer
+        la fin de la réponse en cours.
+        """
+        self.broken = True
+        for chunk_text in split_text(text):
+            request_id = connect_id()
+            await self.ws.send_str(ssml_message(request_id, make_ssml(chunk_text, voice, rate, volume)))
+            async for data in self._receive_turn():
+                yield data
+        self.requests += 1
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    async def _receive_turn(self):
+        audio_received = False
+        while True:
+            try:
+                message = await self.ws.receive(timeout=self.receive_timeout)
+            except asyncio.TimeoutError:
+                raise SessionError(f"Aucune réponse du service depuis {self.receive_timeout} s")
+            if message.type == aiohttp.WSMsgType.PING:
+                await self.ws.pong(message.data)
+            elif message.type == aiohttp.WSMsgType.PONG:
+                continue
+            elif message.type == aiohttp.WSMsgType.TEXT:
+                headers, _ = parse_headers(message.data.encode('utf-8'))
+                path = headers.get(b"Path")
+                if path == b"turn.end":
+                    break
+                if path not in (b"turn.start", b"response", b"audio.metadata"):
+                    raise SessionError(f"Message inattendu du service : {path!r}")
+            elif message.type == aiohttp.WSMsgType.BINARY:
+                headers, data = parse_binary_message(message.data)
+                if headers.get(b"Path") != b"audio":
+                    raise SessionError("Message binaire sans audio")
+                if data:
+                    audio_received = True
+                    yield data
+            elif message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING,
+                                  aiohttp.WSMsgType.CLOSED):
+                raise SessionError("Connexion fermée par le service pendant la synthèse")
+            elif message.type == aiohttp.WSMsgType.ERROR:
+                raise SessionError(f"Erreur de connexion : {message.data}")
+        if not audio_received:
+            raise SessionError("Aucun audio reçu du service")
+
+    async def close(self):
+        if self.ws is not None:
+            try:
+                # Sans réponse rapide du service, aiohttp coupe la connexion à l'expiration du délai
+                await asyncio.wait_for(self.ws.close(), CLOSE_TIMEOUT)
+            except Exception:
+                pass
+
+class SessionPool:
+    """
+    Ensemble de connexions websocket au service de synthèse.
+
+    Chaque requête (stream) prend une connexion libre ou en ouvre une nouvelle ;
+    elle est remise dans le lot à la fin si elle est saine, et fermée sinon. Au plus size connexions inactives sont conservées : la concurrence
+    reste fixée par l'appelant (contrôleur de débit). Les connexions inactives
+    depuis longtemps sont vérifiées avant réutilisation, une connexion en
+    erreur est remplacée, et une requête interrompue par la perte d'une
+    connexion réutilisée est rejouée une fois sur une nouvelle connexion.
+    """
+    def __init__(self, url=None, size=DEFAULT_POOL_SIZE, headers=None,
+                 connect_timeout=CONNECT_TIMEOUT, receive_timeout=RECEIVE_TIMEOUT,
+                 max_requests_per_session=MAX_REQUESTS_PER_SESSION):
+        if url is None and WSS_URL is None:
+            raise RuntimeError("Le service Edge nécessite le paquet edge-tts (pip install edge-tts)")
+        self.url = url or WSS_URL
+        self.size = max(0, size)
+        self.headers = headers if headers is not None else (WSS_HEADERS if self.url == WSS_URL else {})
+        self.connect_timeout = connect_timeout
+        self.receive_timeout = receive_timeout
+        self.max_requests_per_session = max_requests_per_session
+        self.idle = []  # Connexions libres, la plus récemment utilisée en dernier
+        self.http = None
+        self.connections_opened = 0
+        self.reconnects = 0
+        self.requests = 0
+        self._lock = asyncio.Lock()
+        self._closed = False
+
+    async def _http(self):
+        if self.http is None:
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout)
+            self.http = aiohttp.ClientSession(timeout=timeout, trust_env=True)
+        return self.http
+
+    async def _open(self):
+        session = TTSSession(await self._http(), self.url, self.headers, self.receive_timeout)
+        try:
+            await session.connect()
+        except aiohttp.WSServerHandshakeError as e:
+            if e.status != 403 or DRM is None or self.url != WSS_URL:
+                raise
+            # Jeton refusé (horloge décalée) : corriger l'heure de référence et réessayer une fois
+            DRM.handle_client_response_error(e)
+            await session.connect()
+        self.connections_opened += 1
+        return session
+
+    async def _take(self):
+        """
+        Retourne une connexion libre et saine, ou en ouvre une nouvelle ; le booléen
+        indique si la connexion a déjà servi.
+        """
+        while True:
+            # Seul le retrait de la connexion se fait sous le verrou : la vérification
+            # (ping) d'une connexion douteuse ne doit pas bloquer les autres requêtes
+            async with self._lock:
+                if self._closed:
+                    raise RuntimeError("Lot de connexions fermé")
+                if not self.idle:
+                    break
+                session = self.idle.pop()
+            if time.monotonic() - session.last_used > MAX_IDLE_SECONDS:
+                await session.close()
+                continue
+            if await session.is_healthy():
+                return session, True
+            logging.debug("Connexion de synthèse inactive perdue, remplacement")
+            self.reconnects += 1
+            await session.close()
+        return await self._open(), False
+
+    async def _give_back(self, session):
+        if (self._closed or session.broken or session.closed or len(self.idle) >= self.size
+                or session.requests >= self.max_requests_per_session):
+            await session.close()
+            return
+        self.idle.append(session)
+
+    async def stream(self, text, voice, rate='+0%', volume='+0%'):
+        """
+        Générateur asynchrone des morceaux audio du texte, sur une connexion du lot.
+        """
+        self.requests += 1
+        session, reused = await self._take()
+        try:
+            started = False
+            try:
+                async for data in session.stream(text, voice, rate, volume):
+                    started = True
+                    yield data
+                return
+            except (SessionError, ConnectionError, aiohttp.ClientError) as e:
+                # Une connexion réutilisée peut avoir été coupée par le service entre deux
+                # requêtes : rejouer sur une connexion neuve si rien n'a encore été transmis
+                if not reused or started:
+                    raise
+                logging.debug(f"Connexion de synthèse perdue ({e}), nouvelle tentative sur une connexion neuve")
+            await session.close()
+            self.reconnects += 1
+            session = await self._open()
+            async for data in session.stream(text, voice, rate, volume):
+                yield data
+        finally:
+            await self._give_back(session)
+
+    async def aclose(self):
+        async with self._lock:
+            self._closed = True
+            idle, self.idle = self.idle, []
+        for session in idle:
+            await session.close()
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
+
+    def stats(self):
+        return {
+            'idle': len(self.idle),
+            'connections_opened': self.connections_opened,
+            'reconnects': self.reconnects,
+            'requests': self.requests,
+        }
@@ -3,8 +3,20 @@
 import os
 import sys
 from pathlib import Path
+import re
+import queue
+import signal
+import logging
+import threading
 import subprocess
 import shutil
+from collections import deque
+
+# Avancement affiché par ebook-convert (« 34% Running transforms on e-book... »)
+CALIBRE_PROGRESS_PATTERN = re.compile(r'^\s*(\d{1,3})%\s*(.*)')
+CALIBRE_OUTPUT_LINES = 200  # Dernières lignes de sortie conservées pour les messages d'erreur
+CALIBRE_POLL_INTERVAL = 0.2  # Délai maximal (secondes) entre deux vérifications de l'annulation
+CALIBRE_STOP_TIMEOUT = 5     # Délai laissé à Calibre pour s'arrêter avant d'être tué
 
 def resource_path(relative_path):
     """
@@ -73,13 +85,15 @@ def create_unique_filename(directory, base_name, extension):
         counter += 1
     return file_name
 
-def convert_epub_to_pdf(epub_path, output_dir):
+def convert_epub_to_pdf(epub_path, output_dir, on_progress=None, should_stop=None):
     """
     Convertit un fichier ePub en PDF en utilisant Calibre.
     
     :param epub_path: Chemin vers le fichier ePub
     :param output_dir: Répertoire de sortie pour le fichier PDF
-    :return: Chemin vers le fichier PDF généré, ou None en cas d'erreur
+    :param on_progress: Fonction appelée avec (pourcentage, étape) à chaque avancement signalé par Calibre
+    :param should_stop: Fonction sans argument ; la conversion est interrompue dès qu'elle retourne True
+    :return: Chemin vers le fichier PDF généré, ou None en cas d'erreur ou d'annulation
     """
     try:
         base_name = os.path.splitext(os.path.basename(epub_path))[0]
@@ -106,18 +120,87 @@ def convert_epub_to_pdf(epub_path, output_dir):
         # Commande pour convertir ePub en PDF
         command = [ebook_convert, epub_path, pdf_path]
         
-        # Exécuter la commande
-        result = subprocess.run(command, check=True, capture_output=True, text=True)
+        # Exécuter la commande en lisant sa sortie au fil de l'eau : Calibre
+        # signale son avancement par des lignes « 34% Étape... »
+        # Groupe de processus distinct (POSIX) : l'annulation arrête aussi les processus
+        # de travail lancés par Calibre
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   text=True, errors='replace', start_new_session=os.name == 'posix')
+        output = deque(maxlen=CALIBRE_OUTPUT_LINES)
+        stopped = False
+        # La sortie est lue dans un thread : l'annulation est vérifiée régulièrement,
+        # même pendant les étapes où Calibre n'écrit rien
+        lines = queue.Queue()
+        reader = threading.Thread(target=read_lines, args=(process.stdout, lines), daemon=True)
+        reader.start()
+        with process:
+            while True:
+                if should_stop is not None and should_stop():
+                    stopped = True
+                    stop_process(process)
+                    break
+                try:
+                    line = lines.get(timeout=CALIBRE_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if line is None:
+                    break
+                output.append(line)
+                match = CALIBRE_PROGRESS_PATTERN.match(line)
+                if match and on_progress is not None:
+                    on_progress(int(match.group(1)), match.group(2).strip())
+        if stopped:
+            logging.info("Conversion en PDF annulée.")
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
+            return None
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, stderr=''.join(output))
         
         if os.path.exists(pdf_path):
             return pdf_path
         else:
-            print(f"Erreur : Le fichier PDF n'a pas été créé. Sortie de Calibre : {result.stdout}")
+            logging.error(f"Le fichier PDF n'a pas été créé. Sortie de Calibre : {''.join(output)}")
             return None
     except subprocess.CalledProcessError as e:
-        print(f"Erreur lors de la conversion : {e}")
-        print(f"Sortie d'erreur de Calibre : {e.stderr}")
+        logging.error(f"Erreur lors de la conversion : {e}")
+        logging.error(f"Sortie d'erreur de Calibre : {e.stderr}")
         return None
     except Exception as e:
-        print(f"Une erreur inattendue s'est produite : {e}")
+        logging.error(f"Une erreur inattendue s'est produite : {e}")
         return None
+
+def stop_process(process, timeout=CALIBRE_STOP_TIMEOUT):
+    """
+    Arrête le processus (et son groupe sous POSIX), puis le tue s'il ne s'est pas
+    arrêté après timeout secondes.
+    """
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+        process.wait(timeout)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+def read_lines(stream, lines):
+    """
+    Transmet les lignes de stream à la file lines, puis None à la fin du flux.
+    """
+    try:
+        for line in stream:
+            lines.put(line)
+    except (OSError, ValueError):
+        pass  # Flux fermé après l'arrêt du processus
+    finally:
+        lines.put(None)